@@ -2,9 +2,15 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import hashlib
+import itertools
+import json
+
 from odoo.addons.component.core import Component
 
 from ..log import LOGGER_NAME, logger
+from ..utils.import_utils import gen_chunks
+from ..utils.mapper_utils import get_lookup_cache
 
 
 class RecordSetImporter(Component):
@@ -24,20 +30,100 @@ class RecordSetImporter(Component):
         * read source
         * process all source lines in chunks
         * create an import record per each chunk
+          (storing its lines or a reference to them)
         * schedule import for each record
+        * records are created and their jobs linked by batches
+        * commit records by batches if `split_batch_size` is set on import type
+          (a retry of the same job resumes after the last committed batch)
         """
-        # reset recordset
-        recordset._prepare_for_import_session()
-        msg = "START RECORDSET {} ({})".format(recordset.name, recordset.id)
+        batch_size = self._split_batch_size(recordset)
+        count = self._split_resume_from(recordset) if batch_size else 0
+        if count:
+            msg = "RESUME RECORDSET {} ({}) after {} chunks".format(
+                recordset.name, recordset.id, count
+            )
+        else:
+            # reset recordset
+            recordset._prepare_for_import_session()
+            if batch_size:
+                recordset.set_shared({"_split_session": self._split_session()})
+            msg = "START RECORDSET {} ({})".format(recordset.name, recordset.id)
         logger.info(msg)
         # flush existing records as we are going to re-create them
         source = recordset.get_source()
-        for chunk in source.get_lines():
+        use_refs = source.use_chunk_refs()
+        if use_refs:
+            chunks = source.get_chunk_refs()
+        else:
+            # copy chunks as sources might recycle the same list for each one
+            # (eg: `gen_chunks`) while we buffer them by batches
+            chunks = (list(chunk) for chunk in source.get_lines())
+        # skip chunks already committed
+        chunks = itertools.islice(chunks, count, None)
+        chunksize = batch_size or self._create_batch_size
+        for batch in gen_chunks(chunks, chunksize=chunksize):
+            if not batch:
+                continue
             # create chuncked records and run their imports
-            record = self.env["import.record"].create({"recordset_id": recordset.id})
+            records = self._create_records(recordset, source, batch, use_refs)
+            records.run_import()
+            count += len(batch)
+            if batch_size:
+                self._commit_split_batch(recordset, count)
+
+    # max number of import records to create at once
+    _create_batch_size = 100
+
+    def _create_records(self, recordset, source, chunks, use_refs=False):
+        """Create import records for given chunks w/ a single `create`."""
+        model = self.env["import.record"]
+        data_format = recordset.import_type_id.chunk_data_format
+        vals_list = []
+        for chunk in chunks:
+            vals = {"recordset_id": recordset.id}
             # store data
-            record.set_data(chunk)
-            record.run_import()
+            if use_refs:
+                vals["chunk_ref"] = model._prepare_data_ref(source, chunk)
+            else:
+                vals["jsondata_file"] = model._prepare_data(
+                    chunk, data_format=data_format
+                )
+            vals_list.append(vals)
+        return model.create(vals_list)
+
+    def _split_batch_size(self, recordset):
+        """Return the number of chunks to commit at once while splitting."""
+        import_type = recordset.import_type_id
+        if not import_type.use_job or recordset.debug_mode():
+            # nothing to consume in parallel
+            return 0
+        return import_type.split_batch_size
+
+    def _split_session(self):
+        """Identify the split session, shared by all the tries of a job."""
+        return self.env.context.get("job_uuid")
+
+    def _split_resume_from(self, recordset):
+        """Return the number of chunks committed by a previous try.
+
+        Once a batch of records is committed, their jobs might be running
+        already: a retry of the same job must not split these chunks again.
+        """
+        session = self._split_session()
+        if not session or recordset.get_shared().get("_split_session") != session:
+            return 0
+        return self.env["import.record"].search_count(
+            [("recordset_id", "=", recordset.id)]
+        )
+
+    def _commit_split_batch(self, recordset, count):
+        """Commit created records to let their jobs start right away."""
+        # pylint: disable=invalid-commit
+        self.env.cr.commit()
+        msg = "RECORDSET {} ({}): {} chunks committed".format(
+            recordset.name, recordset.id, count
+        )
+        logger.info(msg)
 
 
 class RecordImporter(Component):
@@ -79,6 +165,30 @@ class RecordImporter(Component):
             logger_name=LOGGER_NAME,
             log_prefix=self.recordset.import_type_id.key + " ",
         )
+        self._init_plan()
+
+    # keys to check and translate on each line, computed once per run
+    _required_plan = None
+    _translatable_plan = None
+
+    def _init_plan(self):
+        self._required_plan = tuple(
+            (source_key, tuple(dest_keys))
+            for source_key, dest_keys in self.required_keys().items()
+        )
+        self._translatable_plan = self._make_translatable_plan()
+
+    def _make_translatable_plan(self):
+        """Return `(lang, key, translation key)` tuples to look for in lines."""
+        keys = tuple(self.translatable_keys())
+        # search langs only if needed
+        langs = self.translatable_langs() if keys else []
+        # eg: name:fr_FR
+        return tuple(
+            (lang, key, self.make_translation_key(key, lang))
+            for lang in langs
+            for key in keys
+        )
 
     # Override to not rely on automatic mapper lookup.
     # This is especially needed if you register more than one importer
@@ -103,7 +213,8 @@ class RecordImporter(Component):
 
     def required_keys(self, create=False):
         """Keys that are mandatory to import a line."""
-        req = self.mapper.required_keys()
+        # copy to not alter mapper's attribute
+        req = dict(self.mapper.required_keys())
         all_values = []
         for k, v in req.items():
             # make sure values are always tuples
@@ -150,17 +261,15 @@ class RecordImporter(Component):
         within the attribute `translatable`.
         """
         translatable = {}
-        if not self.translatable_keys():
-            return translatable
-        for lang in self.translatable_langs():
-            for key in self.translatable_keys():
-                # eg: name:fr_FR
-                tkey = self.make_translation_key(key, lang)
-                if tkey in orig_values and values.get(key):
-                    if lang not in translatable:
-                        translatable[lang] = {}
-                    # we keep only translation for existing values
-                    translatable[lang][key] = orig_values.get(tkey)
+        plan = self._translatable_plan
+        if plan is None:
+            plan = self._make_translatable_plan()
+        for lang, key, tkey in plan:
+            if tkey in orig_values and values.get(key):
+                if lang not in translatable:
+                    translatable[lang] = {}
+                # we keep only translation for existing values
+                translatable[lang][key] = orig_values.get(tkey)
         return translatable
 
     def _check_missing(self, source_key, dest_key, values, orig_values):
@@ -190,8 +299,10 @@ class RecordImporter(Component):
         or a dictionary containing info about skip reason.
         """
         msg = ""
-        required = self.required_keys()
-        for source_key, dest_key in required.items():
+        required = self._required_plan
+        if required is None:
+            required = self.required_keys().items()
+        for source_key, dest_key in required:
             # we support multiple destination keys
             for _dest_key in dest_key:
                 missing = self._check_missing(
@@ -252,14 +363,17 @@ class RecordImporter(Component):
         return self._cleanup_line(line)
 
     def _do_report(self):
-        """Update recordset report using the tracker."""
-        previous = self.recordset.get_report()
-        report = self.tracker.get_report(previous)
-        self.recordset.set_report({self.model._name: report})
+        """Append the chunk report of the tracker to the recordset."""
+        self.recordset.add_chunk_report(
+            self.model._name,
+            self.tracker.chunk_report.to_report(),
+            record=self.record,
+            counters=self.tracker.get_counters(),
+        )
 
     def _record_lines(self):
         """Get lines from import record."""
-        return self.record.get_data()
+        return self.record.iter_data()
 
     def _load_mapper_options(self):
         """Retrieve mapper options."""
@@ -274,6 +388,435 @@ class RecordImporter(Component):
         """Inject context variables on write, merged by odoorecord handler."""
         return {"tracking_disable": True}
 
+    def _map_lines(self, lines):
+        """Convert prepared lines to odoo values.
+
+        Yield `(line, values)` tuples. Lines that cannot be converted
+        are tracked as errored and not yielded.
+        """
+        if self._savepoint_batch_size() > 1:
+            yield from self._run_savepoint_batches(
+                lines, self._map_batch, self._map_line
+            )
+            return
+        for line in lines:
+            res = self._map_line(line)
+            if res is not None:
+                yield res
+
+    def _map_line(self, line):
+        """Convert a line, return `(line, values)` or None on failure."""
+        options = self._load_mapper_options()
+        try:
+            with self.env.cr.savepoint():
+                values = self.mapper.map_record(line).values(**options)
+            logger.debug(values)
+        except Exception as err:
+            values = {}
+            self.tracker.log_error(values, line, None, message=err)
+            if self._break_on_error:
+                raise
+            return None
+        return line, values
+
+    def _map_batch(self, lines):
+        options = self._load_mapper_options()
+        return [
+            (line, self.mapper.map_record(line).values(**options)) for line in lines
+        ]
+
+    def _import_line(self, line, values, savepoint=True):
+        """Create or update the odoo record matching given line.
+
+        W/o `savepoint` errors are raised and left to the caller.
+        """
+        # apply changes pending for the same key first:
+        # `skip_it` must see the record to create or update
+        if self._is_create_pending(values):
+            self._flush_creates()
+        if self._is_write_pending(values):
+            self._flush_writes()
+        # handle forced skipping
+        skip_info = self.skip_it(values, line)
+        if skip_info:
+            self.tracker.log_skipped(values, line, skip_info)
+            return
+
+        if not savepoint:
+            self._import_values(line, values)
+            return
+        try:
+            with self.env.cr.savepoint():
+                self._import_values(line, values)
+        except Exception as err:
+            self.tracker.log_error(values, line, None, message=err)
+            if self._break_on_error:
+                raise
+
+    def _import_values(self, line, values):
+        if self.record_handler.odoo_exists(values, line):
+            if self._pending_writes is not None:
+                self._queue_write(values, line)
+                return
+            odoo_record = self.record_handler.odoo_write(values, line)
+            self.tracker.log_updated(values, line, odoo_record)
+        else:
+            if self.work.options.importer.write_only:
+                self.tracker.log_skipped(
+                    values,
+                    line,
+                    {"message": "Write-only importer, record not found."},
+                )
+                return
+            if self._pending_creates is not None:
+                self._queue_create(values, line)
+                return
+            odoo_record = self.record_handler.odoo_create(values, line)
+            self.tracker.log_created(values, line, odoo_record)
+
+    def _import_lines(self, mapped_lines):
+        """Create or update odoo records for given `(line, values)` tuples."""
+        if self._savepoint_batch_size() > 1:
+            self._run_savepoint_batches(
+                mapped_lines, self._import_batch, self._import_mapped_line
+            )
+            return
+        for line, values in mapped_lines:
+            self._import_line(line, values)
+
+    def _import_mapped_line(self, mapped_line):
+        self._import_line(*mapped_line)
+
+    def _import_batch(self, mapped_lines):
+        for line, values in mapped_lines:
+            self._import_line(line, values, savepoint=False)
+        # apply delayed changes before releasing the savepoint
+        self._flush_pending()
+        return []
+
+    def _map_and_import_lines(self, lines):
+        """Map and import lines one after the other, by savepoint batches."""
+        self._run_savepoint_batches(
+            lines, self._map_and_import_batch, self._map_and_import_line
+        )
+
+    def _map_and_import_line(self, line):
+        mapped_line = self._map_line(line)
+        if mapped_line is not None:
+            self._import_line(*mapped_line)
+
+    def _map_and_import_batch(self, lines):
+        options = self._load_mapper_options()
+        for line in lines:
+            values = self.mapper.map_record(line).values(**options)
+            self._import_line(line, values, savepoint=False)
+        self._flush_pending()
+        return []
+
+    def _savepoint_batch_size(self):
+        """Number of lines sharing the same savepoint.
+
+        By default each line is mapped and imported in its own savepoints.
+        Set `importer.savepoint_batch_size` option to process lines by batches
+        under one savepoint instead: if a batch fails, it's rolled back
+        and split until the broken lines are isolated and reported one by one.
+        """
+        return self.work.options.importer.savepoint_batch_size or 0
+
+    def _run_savepoint_batches(self, items, func, func_single):
+        """Run `func` on batches of items, each one under a savepoint.
+
+        :param func: takes a list of items and returns a list of results
+        :param func_single: takes one item, returns one result or None.
+            Used on the items that cannot be processed in a batch.
+        :return: list of results
+        """
+        res = []
+        for batch in gen_chunks(items, chunksize=self._savepoint_batch_size()):
+            res.extend(self._run_savepoint_batch(list(batch), func, func_single))
+        return res
+
+    def _run_savepoint_batch(self, items, func, func_single):
+        if not items:
+            return []
+        if len(items) == 1:
+            res = func_single(items[0])
+            return [] if res is None else [res]
+        # pending changes of previous lines must survive a rollback,
+        # including the ones queued by `func_single` in batch modes
+        self._flush_pending()
+        self.model.flush()
+        self._begin_batch()
+        try:
+            with self.env.cr.savepoint():
+                res = func(items)
+                # let delayed errors raise while the savepoint is still open
+                self.model.flush()
+        except Exception:
+            self._discard_batch()
+            logger.debug("Savepoint batch failed, splitting it.")
+            half = len(items) // 2
+            res = self._run_savepoint_batch(items[:half], func, func_single)
+            return res + self._run_savepoint_batch(items[half:], func, func_single)
+        self._end_batch()
+        return res
+
+    def _begin_batch(self):
+        self.tracker.begin_batch()
+        self.record_handler.begin_batch()
+        get_lookup_cache(self.mapper).begin_batch()
+
+    def _end_batch(self):
+        self.tracker.end_batch()
+        self.record_handler.end_batch()
+        get_lookup_cache(self.mapper).end_batch()
+
+    def _discard_batch(self):
+        """Forget the state of a rolled back batch."""
+        # drop cached values and changes not flushed to the database
+        self.env.clear()
+        self.tracker.discard_batch()
+        self.record_handler.discard_batch()
+        get_lookup_cache(self.mapper).discard_batch()
+        # queues are flushed before a batch begins: they hold its lines only
+        if self._pending_creates is not None:
+            self._pending_creates = []
+            self._pending_create_keys = set()
+        if self._pending_writes is not None:
+            self._pending_writes = {}
+            self._pending_write_keys = set()
+
+    def _flush_pending(self):
+        """Apply changes delayed by batch modes."""
+        if self._pending_creates is not None:
+            self._flush_creates()
+        if self._pending_writes is not None:
+            self._flush_writes()
+        self.record_handler.flush()
+
+    # values and lines of records to create, see `_flush_creates`
+    _pending_creates = None
+    _pending_create_keys = None
+
+    def _pending_key(self, values):
+        key = self.record_handler.unique_key
+        if not key or key not in values:
+            return None
+        try:
+            hash(values[key])
+        except TypeError:
+            return None
+        return values[key]
+
+    def _is_create_pending(self, values):
+        return bool(self._pending_create_keys) and (
+            self._pending_key(values) in self._pending_create_keys
+        )
+
+    def _queue_create(self, values, line):
+        # run within the line's savepoint, once for all
+        self.record_handler.odoo_pre_create(values, line)
+        self._pending_creates.append((values, line))
+        key = self._pending_key(values)
+        if key is not None:
+            self._pending_create_keys.add(key)
+
+    # records and values to write grouped by values, see `_flush_writes`
+    _pending_writes = None
+    _pending_write_keys = None
+
+    def _is_write_pending(self, values):
+        return bool(self._pending_write_keys) and (
+            self._pending_key(values) in self._pending_write_keys
+        )
+
+    def _queue_write(self, values, line):
+        odoo_record, values_for_write = self.record_handler.odoo_prepare_write(
+            values, line
+        )
+        group_key = repr(sorted(values_for_write.items()))
+        self._pending_writes.setdefault(group_key, []).append(
+            (odoo_record, values, values_for_write, line)
+        )
+        key = self._pending_key(values)
+        if key is not None:
+            self._pending_write_keys.add(key)
+
+    def _flush_writes(self):
+        """Update queued records w/ one `write` per group of identical values.
+
+        If a group fails, including the finalization of any of its records,
+        the whole group is rolled back and its records are updated one by one
+        so that only broken lines are reported as errored.
+        """
+        pending = self._pending_writes
+        if not pending:
+            return
+        self._pending_writes = {}
+        self._pending_write_keys = set()
+        for group in pending.values():
+            values_for_write = group[0][2]
+            odoo_records = self.model.browse(
+                [odoo_record.id for odoo_record, *__ in group]
+            ).with_context(**self.record_handler.write_context())
+            try:
+                with self.env.cr.savepoint():
+                    if values_for_write:
+                        odoo_records.write(values_for_write.copy())
+                    for odoo_record, values, values_for_write, line in group:
+                        self.record_handler.odoo_finalize_write(
+                            odoo_record, values, values_for_write, line
+                        )
+            except Exception:
+                logger.debug("Grouped write failed, falling back to single writes.")
+                for odoo_record, values, values_for_write, line in group:
+                    self._write_line(odoo_record, values, values_for_write, line)
+                continue
+            for odoo_record, values, __, line in group:
+                self.tracker.log_updated(values, line, odoo_record)
+
+    def _write_line(self, odoo_record, values, values_for_write, line):
+        try:
+            with self.env.cr.savepoint():
+                if values_for_write:
+                    odoo_record.write(values_for_write)
+                self.record_handler.odoo_finalize_write(
+                    odoo_record, values, values_for_write, line
+                )
+                self.tracker.log_updated(values, line, odoo_record)
+        except Exception as err:
+            self.tracker.log_error(values, line, odoo_record, message=err)
+            if self._break_on_error:
+                raise
+
+    def _create_line(self, values, line):
+        """Create a queued record alone, `odoo_pre_create` ran already."""
+        odoo_record = None
+        try:
+            with self.env.cr.savepoint():
+                new_record = self.record_handler.odoo_create_multi([values], [line])
+                self.record_handler.odoo_finalize_create(new_record, values, line)
+                odoo_record = new_record
+                self.tracker.log_created(values, line, odoo_record)
+        except Exception as err:
+            self.tracker.log_error(values, line, odoo_record, message=err)
+            if self._break_on_error:
+                raise
+
+    def _flush_creates(self):
+        """Create queued records w/ a single `create` call.
+
+        If the batch fails, records are created one by one
+        so that only broken lines are reported as errored.
+        """
+        pending = self._pending_creates
+        if not pending:
+            return
+        self._pending_creates = []
+        self._pending_create_keys = set()
+        try:
+            with self.env.cr.savepoint():
+                odoo_records = self.record_handler.odoo_create_multi(
+                    [values for values, __ in pending], [line for __, line in pending]
+                )
+        except Exception:
+            logger.debug("Batch create failed, falling back to single creates.")
+            for values, line in pending:
+                self._create_line(values, line)
+            return
+        for odoo_record, (values, line) in zip(odoo_records, pending):
+            try:
+                with self.env.cr.savepoint():
+                    self.record_handler.odoo_finalize_create(odoo_record, values, line)
+                    self.tracker.log_created(values, line, odoo_record)
+            except Exception as err:
+                # drop the record as a failed single create would do
+                try:
+                    with self.env.cr.savepoint():
+                        odoo_record.unlink()
+                except Exception:
+                    logger.exception("Cannot drop %s", odoo_record)
+                self.tracker.log_error(values, line, None, message=err)
+                if self._break_on_error:
+                    raise
+
+    # mapped values hashes by line number, see `_filter_unchanged_lines`
+    _line_hashes = None
+
+    def _use_line_hashes(self):
+        """Tell if lines w/ the same values as last import must be skipped.
+
+        Enable it via `importer.skip_unchanged_lines` option.
+        It requires an unique key to identify lines across imports.
+        """
+        return bool(
+            self.work.options.importer.skip_unchanged_lines
+            and self.record_handler.unique_key
+        )
+
+    def _line_hash_key(self, values):
+        key = values.get(self.record_handler.unique_key)
+        return None if key is None else str(key)
+
+    def _filter_unchanged_lines(self, mapped_lines):
+        """Skip lines whose values hash is the same as the last import one.
+
+        Yield `(line, values)` tuples for lines to import.
+        Stored hashes of the chunk are retrieved all at once.
+        """
+        self._line_hashes = {}
+        mapped_lines = list(mapped_lines)
+        for line, values in mapped_lines:
+            key = self._line_hash_key(values)
+            if key is not None:
+                hash_ = self._hash_values(values, line)
+                self._line_hashes[line["_line_nr"]] = (key, hash_)
+        stored = self.env["import.line.hash"]._get_hashes(
+            self.recordset.import_type_id,
+            self.model._name,
+            {key for key, __ in self._line_hashes.values()},
+        )
+        # records might have been deleted in the meantime
+        existing = set(
+            self.model.browse([res_id for __, res_id in stored.values()]).exists().ids
+        )
+        for line, values in mapped_lines:
+            key, hash_ = self._line_hashes.get(line["_line_nr"], (None, None))
+            if key in stored and stored[key][0] == hash_ and stored[key][1] in existing:
+                self.tracker.log_unchanged(
+                    values, line, odoo_record=self.model.browse(stored[key][1])
+                )
+                continue
+            yield line, values
+
+    def _hash_values(self, values, line=None):
+        """Hash mapped values and translations read from the line, if any."""
+        data = values
+        translations = {
+            tkey: line[tkey]
+            for __, __, tkey in self._translatable_plan or ()
+            if line and tkey in line
+        }
+        if translations:
+            data = {"values": values, "translations": translations}
+        data = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _store_line_hashes(self):
+        """Store hashes of the lines successfully imported."""
+        report = self.tracker.chunk_report
+        errored = {item["line_nr"] for item in report.get_items("errored")}
+        rows = []
+        for item in report.get_items("created") + report.get_items("updated"):
+            line_nr = item["line_nr"]
+            if line_nr in self._line_hashes and line_nr not in errored:
+                key, hash_ = self._line_hashes[line_nr]
+                rows.append((key, hash_, item["odoo_record"]))
+        self.env["import.line.hash"]._set_hashes(
+            self.recordset.import_type_id, self.model._name, rows
+        )
+        self._line_hashes = None
+
     def run(self, record, is_last_importer=True, **kw):
         """Run record job.
 
@@ -284,9 +827,16 @@ class RecordImporter(Component):
         * read each line to be imported
         * clean them up
         * manipulate them (field names fixes and such)
+        * if enabled, look up related records for all lines at once
         * retrieve a mapper and convert values
+        * if enabled, skip lines that did not change since last import
+        * if enabled, look up existing records for all lines at once
         * check and skip record if needed
         * if record exists: update it, else, create it
+          (if enabled, all new records are created at once at the end
+          and updates sharing the same values are written together)
+        * if enabled, lines are mapped and imported by batches
+          sharing the same savepoint
         * produce a report and store it on recordset
         """
 
@@ -298,65 +848,54 @@ class RecordImporter(Component):
             return
 
         self._init_importer(self.record.recordset_id)
-        for line in self._record_lines():
-            line = self.prepare_line(line)
-            options = self._load_mapper_options()
-
-            odoo_record = None
-
-            try:
-                with self.env.cr.savepoint():
-                    values = self.mapper.map_record(line).values(**options)
-                logger.debug(values)
-            except Exception as err:
-                values = {}
-                self.tracker.log_error(values, line, odoo_record, message=err)
-                if self._break_on_error:
-                    raise
-                continue
-
-            # handle forced skipping
-            skip_info = self.skip_it(values, line)
-            if skip_info:
-                self.tracker.log_skipped(values, line, skip_info)
-                continue
-
-            try:
-                with self.env.cr.savepoint():
-                    if self.record_handler.odoo_exists(values, line):
-                        odoo_record = self.record_handler.odoo_write(values, line)
-                        self.tracker.log_updated(values, line, odoo_record)
-                    else:
-                        if self.work.options.importer.write_only:
-                            self.tracker.log_skipped(
-                                values,
-                                line,
-                                {"message": "Write-only importer, record not found."},
-                            )
-                            continue
-                        odoo_record = self.record_handler.odoo_create(values, line)
-                        self.tracker.log_created(values, line, odoo_record)
-            except Exception as err:
-                self.tracker.log_error(values, line, odoo_record, message=err)
-                if self._break_on_error:
-                    raise
-                continue
+        if self.record_handler.use_batch_create():
+            self._pending_creates = []
+            self._pending_create_keys = set()
+        if self.record_handler.use_grouped_write():
+            self._pending_writes = {}
+            self._pending_write_keys = set()
+        lines = (self.prepare_line(line) for line in self._record_lines())
+        if self.work.options.mapper.prefetch_relations:
+            # let the mapper look up related records for all lines at once
+            lines = list(lines)
+            self.mapper.prefetch(lines)
+        premap = self._use_line_hashes() or self.record_handler.use_lookup_index()
+        if self._savepoint_batch_size() > 1 and not premap:
+            self._map_and_import_lines(lines)
+        else:
+            mapped_lines = self._map_lines(lines)
+            if self._use_line_hashes():
+                # skip lines that did not change since last import
+                mapped_lines = list(self._filter_unchanged_lines(mapped_lines))
+            if self.record_handler.use_lookup_index():
+                # map all the lines first to find existing records in one go
+                mapped_lines = list(mapped_lines)
+                self.record_handler.prefetch([values for __, values in mapped_lines])
+            self._import_lines(mapped_lines)
+        self._flush_pending()
+        self._pending_creates = self._pending_create_keys = None
+        self._pending_writes = self._pending_write_keys = None
+
+        if self._line_hashes is not None:
+            self._store_line_hashes()
 
         # update report
         self._do_report()
 
         # log chunk finished
         counters = self.tracker.get_counters()
-        msg = " ".join(
-            [
-                "CHUNK FINISHED",
-                "[created: {created}]",
-                "[updated: {updated}]",
-                "[skipped: {skipped}]",
-                "[errored: {errored}]",
-            ]
-        ).format(**counters)
-        self.tracker._log(msg)
+        self.tracker.log_summary(counters)
+        lookup_cache = getattr(self.mapper, "_lookup_cache", None)
+        if lookup_cache is not None:
+            self.tracker._log(
+                "LOOKUP CACHE [hits: {}] [misses: {}]".format(
+                    lookup_cache.hits, lookup_cache.misses
+                ),
+                level="debug",
+                event="lookup_cache",
+                hits=lookup_cache.hits,
+                misses=lookup_cache.misses,
+            )
         self._trigger_finish_events(record, is_last_importer=is_last_importer)
         return counters
 
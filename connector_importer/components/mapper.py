@@ -5,6 +5,12 @@
 from odoo.addons.component.core import Component
 from odoo.addons.connector.components.mapper import mapping
 
+_BASE_MAPPER_MODULE = mapping.__module__
+
+
+def _constant(values):
+    return lambda record: values
+
 
 class ImportMapper(Component):
     _name = "importer.base.mapper"
@@ -85,3 +91,77 @@ class ImportMapper(Component):
                 v = self.env.ref(xmlid)[field_value]
             values[k] = v
         return values
+
+    # memoize lookups of related records, see `mapper_utils.backend_to_rel`
+    _lookup_cache_size = 10000
+    _lookup_cache = None
+
+    def prefetch(self, lines):
+        """Let direct mappings resolve the values of all the lines at once.
+
+        Modifiers supporting it (eg: `backend_to_rel`) expose a `prefetch` function.
+        """
+        for from_attr, to_attr in self.direct:
+            prefetch = getattr(from_attr, "prefetch", None)
+            if prefetch:
+                prefetch(self, lines, to_attr)
+
+    # Map lines w/ a plan compiled once per mapper instance,
+    # that is once per chunk. Set it to False to use the standard machinery.
+    _use_mapping_plan = True
+    _mapping_plan = None
+
+    def _apply_with_options(self, map_record):
+        if not self._use_mapping_plan or self.options.fields or self.children:
+            return super()._apply_with_options(map_record)
+        if self._mapping_plan is None:
+            self._mapping_plan = self._compile_mapping_plan()
+        record = map_record.source
+        for_create = self.options.for_create
+        result = {}
+        for to_attr, func, only_create in self._mapping_plan:
+            if only_create and not for_create:
+                continue
+            if to_attr:
+                result[to_attr] = func(record)
+                continue
+            values = func(record)
+            if not values:
+                continue
+            if not isinstance(values, dict):
+                raise ValueError(
+                    "%s: invalid return value for the "
+                    "mapping method %s" % (values, func)
+                )
+            result.update(values)
+        return self.finalize(map_record, result)
+
+    def _compile_mapping_plan(self):
+        """Compile `direct` and `@mapping` methods into a flat plan.
+
+        Return a list of `(to_attr, func, only_create)` tuples:
+        `func(record)` returns the value for `to_attr` if given
+        or a dictionary of values otherwise.
+
+        Default values are resolved once, unless `default_values` is overridden.
+        """
+        plan = []
+        for from_attr, to_attr in self.direct:
+            plan.append((to_attr, self._compile_direct(from_attr, to_attr), False))
+        constant_defaults = type(self).default_values is ImportMapper.default_values
+        for meth, definition in self.map_methods:
+            func = meth
+            if constant_defaults and meth.__name__ == "default_values":
+                func = _constant(self.default_values())
+            plan.append((None, func, definition.only_create))
+        return plan
+
+    def _compile_direct(self, from_attr, to_attr):
+        if callable(from_attr):
+            return lambda record: from_attr(self, record, to_attr)
+        field = self.model._fields.get(to_attr)
+        overridden = type(self)._map_direct.__module__ != _BASE_MAPPER_MODULE
+        if overridden or (field is not None and field.type == "many2one"):
+            # custom or binder based mapping
+            return lambda record: self._map_direct(record, from_attr, to_attr)
+        return lambda record: record.get(from_attr) or False
@@ -2,8 +2,17 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+from odoo import fields, models
+from odoo.tools import float_compare
+
 from odoo.addons.component.core import Component
 
+from ..log import logger
+from ..utils.import_utils import get_xmlid_map
+
+# marks keys missing from the lookup index, see `begin_batch`
+_missing = object()
+
 
 class OdooRecordHandler(Component):
     """Interact w/ odoo importable records."""
@@ -24,6 +33,15 @@ class OdooRecordHandler(Component):
     override_create_date = False
     override_write_uid = False
     override_write_date = False
+    # existing records ids by unique key, see `prefetch`
+    _lookup_index = None
+    # external IDs to create at the end of the chunk, see `flush`
+    _pending_xmlids = None
+    # current values of existing records by id, see `prefetch_current_values`
+    _current_values = None
+    # lookup index keys changed since `begin_batch`, w/ their previous value
+    _batch_index_changes = None
+    _batch_xmlids_count = 0
 
     def _init_handler(self, importer=None, unique_key=None, unique_key_is_xmlid=False):
         self.importer = importer
@@ -34,11 +52,167 @@ class OdooRecordHandler(Component):
         """Domain to find the record in odoo."""
         return [(self.unique_key, "=", values[self.unique_key])]
 
+    def use_lookup_index(self):
+        """Tell if existing records must be looked up for the whole chunk.
+
+        Enable it via `record_handler.use_lookup_index` option.
+
+        All the lines of the chunk are mapped before any of them is imported:
+        mapper lookups (eg: `xmlid_to_rel`, `_xmlid::` values) cannot find
+        records created by previous lines of the same chunk.
+        With an XML-ID unique key, new XML-IDs are created when the chunk
+        is done: `env.ref` does not find them before (eg: in hooks).
+        Do not use it when lines refer to each other (eg: parent categories).
+        """
+        return bool(self.work.options.record_handler.use_lookup_index)
+
+    def use_batch_create(self):
+        """Tell if new records must be created all together for the chunk.
+
+        Enable it via `record_handler.use_batch_create` option.
+        """
+        return bool(self.work.options.record_handler.use_batch_create)
+
+    def use_grouped_write(self):
+        """Tell if updates sharing the same values must be written together.
+
+        Enable it via `record_handler.use_grouped_write` option.
+        """
+        return bool(self.work.options.record_handler.use_grouped_write)
+
+    def prefetch(self, values_list):
+        """Look up existing records for all given values w/ one query.
+
+        Found records are indexed by unique key
+        and `odoo_find` uses this index instead of searching record by record.
+        The index relies on the unique key only: do not use it
+        if you customize `odoo_find_domain`.
+
+        If the unique key is an external ID, missing external IDs
+        are created all together when the chunk is done (see `flush`).
+
+        With `record_handler.skip_fields_unchanged` option,
+        current values of found records are read at once too.
+        """
+        if not self.unique_key:
+            return
+        try:
+            keys = {values.get(self.unique_key) for values in values_list}
+        except TypeError:
+            # unhashable keys, cannot index them
+            return
+        keys.discard(None)
+        if self.unique_key_is_xmlid:
+            self._lookup_index = self._prefetch_xmlids(keys)
+            self._pending_xmlids = []
+        else:
+            self._lookup_index = self._prefetch_keys(keys)
+        if self.work.options.record_handler.skip_fields_unchanged:
+            field_names = set()
+            for values in values_list:
+                field_names.update(values.keys())
+            res_ids = [x for x in self._lookup_index.values() if x]
+            self.prefetch_current_values(self.model.browse(res_ids), field_names)
+
+    def _normalize_key(self, key):
+        """Convert a mapped key to the value read from the database.
+
+        Eg: "5" becomes 5 for an integer unique key.
+        """
+        field = self.model._fields[self.unique_key]
+        value = field.convert_to_cache(key, self.model)
+        # must be usable as index key
+        hash(value)
+        return value
+
+    def _prefetch_keys(self, keys):
+        normalized = {}
+        for key in keys:
+            try:
+                normalized[key] = self._normalize_key(key)
+            except Exception:
+                # not indexed, `odoo_find` will search it
+                continue
+        index = dict.fromkeys(normalized)
+        if normalized:
+            rows = self.model.search_read(
+                [(self.unique_key, "in", list(set(normalized.values())))],
+                [self.unique_key],
+                order="create_date desc",
+            )
+            found = {}
+            for row in rows:
+                value = row[self.unique_key]
+                if isinstance(value, (list, tuple)):
+                    # many2one
+                    value = value[0]
+                # keep the latest record as `odoo_find` does
+                found.setdefault(value, row["id"])
+            for key, value in normalized.items():
+                index[key] = found.get(value)
+        return index
+
+    def _prefetch_xmlids(self, xmlids):
+        found = get_xmlid_map(self.env, xmlids)
+        res_ids = [
+            res_id for model, res_id in found.values() if model == self.model._name
+        ]
+        existing = set(self.model.browse(res_ids).exists().ids)
+        index = {}
+        for xmlid in xmlids:
+            if xmlid not in found:
+                # no external ID at all
+                index[xmlid] = None
+            elif found[xmlid][1] in existing and found[xmlid][0] == self.model._name:
+                index[xmlid] = found[xmlid][1]
+            # any other case (eg: dangling external ID) is handled by `env.ref`
+        return index
+
+    def _is_indexed(self, key):
+        return self._lookup_index is not None and key in self._lookup_index
+
+    def _index_record(self, values, odoo_record):
+        """Register a new record into the lookup index if any."""
+        if self._lookup_index is not None:
+            key = values[self.unique_key]
+            changes = self._batch_index_changes
+            if changes is not None and key not in changes:
+                changes[key] = self._lookup_index.get(key, _missing)
+            self._lookup_index[key] = odoo_record.id
+
+    def begin_batch(self):
+        """Keep track of state changes from now on.
+
+        Used by importers running lines in batches sharing the same savepoint:
+        records created in the batch are gone if it's rolled back,
+        hence they must be dropped from the lookup index (see `discard_batch`).
+        """
+        self._batch_index_changes = {}
+        self._batch_xmlids_count = len(self._pending_xmlids or [])
+
+    def end_batch(self):
+        self._batch_index_changes = None
+
+    def discard_batch(self):
+        """Restore the state the handler had when the batch began."""
+        for key, value in (self._batch_index_changes or {}).items():
+            if value is _missing:
+                self._lookup_index.pop(key, None)
+            else:
+                self._lookup_index[key] = value
+        self._batch_index_changes = None
+        if self._pending_xmlids:
+            del self._pending_xmlids[self._batch_xmlids_count :]
+        # records updated in the batch got their current values dropped:
+        # they will be read again when needed, nothing to restore here
+
     def odoo_find(self, values, orig_values):
         """Find any existing item in odoo."""
         if self.unique_key == "":
             # if unique_key is None we might use as special find domain
             return self.model
+        if self._is_indexed(values[self.unique_key]):
+            return self.model.browse(self._lookup_index[values[self.unique_key]])
         if self.unique_key_is_xmlid:
             item = self.env.ref(values[self.unique_key], raise_if_not_found=False)
             return item
@@ -82,6 +256,23 @@ class OdooRecordHandler(Component):
         odoo_record = self.model.with_context(**self.create_context()).create(
             values.copy()
         )
+        self.odoo_finalize_create(odoo_record, values, orig_values)
+        return odoo_record
+
+    def odoo_create_multi(self, values_list, orig_values_list):
+        """Create new odoo records in one go.
+
+        `odoo_pre_create` must have been called for each values already:
+        the importer does it when a new record is queued.
+        Return created records in the same order as `values_list`.
+        Once done, `odoo_finalize_create` must be called for each record.
+        """
+        return self.model.with_context(**self.create_context()).create(
+            [values.copy() for values in values_list]
+        )
+
+    def odoo_finalize_create(self, odoo_record, values, orig_values):
+        """Complete the creation of a new odoo record."""
         # force uid
         if self.override_create_uid and values.get("create_uid"):
             self._force_value(odoo_record, values, "create_uid")
@@ -94,18 +285,60 @@ class OdooRecordHandler(Component):
         # Set the external ID if necessary
         if self.unique_key_is_xmlid:
             external_id = values[self.unique_key]
-            if not self.env.ref(external_id, raise_if_not_found=False):
-                module, id_ = external_id.split(".", 1)
-                self.env["ir.model.data"].create(
-                    {
-                        "name": id_,
-                        "module": module,
-                        "model": odoo_record._name,
-                        "res_id": odoo_record.id,
-                        "noupdate": False,
-                    }
-                )
-        return odoo_record
+            module, id_ = external_id.split(".", 1)
+            xmlid_vals = {
+                "name": id_,
+                "module": module,
+                "model": odoo_record._name,
+                "res_id": odoo_record.id,
+                "noupdate": False,
+            }
+            if self._is_indexed(external_id):
+                # known as missing: create it w/ the others at the end
+                self._pending_xmlids.append((xmlid_vals, orig_values))
+            elif not self.env.ref(external_id, raise_if_not_found=False):
+                self.env["ir.model.data"].create(xmlid_vals)
+        self._index_record(values, odoo_record)
+
+    def flush(self):
+        """Apply pending changes, called by the importer when the chunk is done."""
+        self._flush_xmlids()
+
+    def _flush_xmlids(self):
+        pending, self._pending_xmlids = self._pending_xmlids, []
+        if not pending:
+            return
+        model_data = self.env["ir.model.data"]
+        try:
+            with self.env.cr.savepoint():
+                model_data.create([vals for vals, __ in pending])
+        except Exception:
+            # create them one by one to spot the broken ones
+            for vals, orig_values in pending:
+                try:
+                    with self.env.cr.savepoint():
+                        model_data.create(vals)
+                except Exception as err:
+                    self._drop_created_record(vals, orig_values)
+                    self.importer.tracker.log_error(
+                        vals, orig_values, message="XML-ID creation failed: %s" % err
+                    )
+
+    def _drop_created_record(self, xmlid_vals, orig_values):
+        """Remove a record created w/o its XML-ID.
+
+        Otherwise the next import would not find it and create a duplicate.
+        """
+        try:
+            with self.env.cr.savepoint():
+                self.model.browse(xmlid_vals["res_id"]).unlink()
+        except Exception:
+            logger.exception("Cannot drop %s", xmlid_vals)
+        xmlid = "{module}.{name}".format(**xmlid_vals)
+        if self._is_indexed(xmlid):
+            self._lookup_index[xmlid] = None
+        # report it as errored only
+        self.importer.tracker.untrack("created", orig_values)
 
     def odoo_pre_write(self, odoo_record, values, orig_values):
         """Do some extra stuff before updating an existing object."""
@@ -123,6 +356,15 @@ class OdooRecordHandler(Component):
 
     def odoo_write(self, values, orig_values):
         """Update an existing odoo record."""
+        odoo_record, values_for_write = self.odoo_prepare_write(values, orig_values)
+        # do write now, if there's anything to write
+        if values_for_write:
+            odoo_record.write(values_for_write)
+        self.odoo_finalize_write(odoo_record, values, values_for_write, orig_values)
+        return odoo_record
+
+    def odoo_prepare_write(self, values, orig_values):
+        """Find the record to update and the values to write on it."""
         # pass context here to be applied always on retrieved record
         odoo_record = self.odoo_find(values, orig_values).with_context(
             **self.write_context()
@@ -133,8 +375,12 @@ class OdooRecordHandler(Component):
         self._odoo_write_purge_values(odoo_record, values_for_write)
         # hook before write
         self.odoo_pre_write(odoo_record, values_for_write, orig_values)
-        # do write now
-        odoo_record.write(values_for_write)
+        return odoo_record, values_for_write
+
+    def odoo_finalize_write(self, odoo_record, values, values_for_write, orig_values):
+        """Complete the update of an existing odoo record."""
+        if self._current_values:
+            self._current_values.pop(odoo_record.id, None)
         # force uid
         if self.override_write_uid and values.get("write_uid"):
             self._force_value(odoo_record, values, "write_uid")
@@ -146,7 +392,6 @@ class OdooRecordHandler(Component):
         # handle translations
         translatable = self.importer.collect_translatable(values, orig_values)
         self.update_translations(odoo_record, translatable)
-        return odoo_record
 
     def _force_value(self, record, values, fname):
         # the query construction is not vulnerable to SQL injection, as we are
@@ -163,9 +408,89 @@ class OdooRecordHandler(Component):
             if fname not in self.model._fields:
                 values.pop(fname)
         # remove fields having the same value
-        field_names = tuple(values.keys())
         if self.work.options.record_handler.skip_fields_unchanged:
-            current_values = odoo_record.read(field_names, load="_classic_write")
-            for k, v in current_values.items():
-                if values[k] != v:
-                    values.pop(k)
+            current_values = self._get_current_values(odoo_record, values.keys())
+            for fname, current in current_values.items():
+                field = self.model._fields[fname]
+                if fname in values and self._is_value_unchanged(
+                    field, values[fname], current
+                ):
+                    values.pop(fname)
+
+    def _comparable_fields(self, field_names):
+        # binary values are too heavy to be read for comparison
+        return [
+            fname
+            for fname in field_names
+            if fname in self.model._fields
+            and self.model._fields[fname].type != "binary"
+        ]
+
+    def prefetch_current_values(self, odoo_records, field_names):
+        """Read current values of given records w/ one query.
+
+        Values are used by `skip_fields_unchanged` option
+        to drop the fields that would not change on write.
+        """
+        self._current_values = {}
+        field_names = self._comparable_fields(field_names)
+        if odoo_records and field_names:
+            for row in odoo_records.read(field_names, load="_classic_write"):
+                self._current_values[row.pop("id")] = row
+
+    def _get_current_values(self, odoo_record, field_names):
+        field_names = self._comparable_fields(field_names)
+        if not field_names:
+            # `read` would load all the fields
+            return {}
+        current = (self._current_values or {}).get(odoo_record.id)
+        if current is None or any(fname not in current for fname in field_names):
+            current = odoo_record.read(field_names, load="_classic_write")[0]
+        current.pop("id", None)
+        return current
+
+    def _is_value_unchanged(self, field, value, current):
+        """Compare a value to write w/ the current one.
+
+        Current values are read w/ `load="_classic_write"`.
+        """
+        if isinstance(value, models.BaseModel):
+            value = value.ids if field.type in ("one2many", "many2many") else value.id
+        if field.type in ("one2many", "many2many"):
+            return self._is_x2many_unchanged(value, current)
+        if field.type in ("float", "monetary"):
+            try:
+                value = float(value or 0.0)
+            except (TypeError, ValueError):
+                return False
+            digits = field.get_digits(self.env) if field.type == "float" else None
+            if digits:
+                return (
+                    float_compare(value, current or 0.0, precision_digits=digits[1])
+                    == 0
+                )
+            return value == (current or 0.0)
+        if field.type == "integer":
+            return (value or 0) == (current or 0)
+        if field.type == "boolean":
+            return bool(value) == bool(current)
+        try:
+            if field.type == "date":
+                value = fields.Date.to_date(value)
+            elif field.type == "datetime":
+                value = fields.Datetime.to_datetime(value)
+        except ValueError:
+            return False
+        # empty values are all the same to odoo (eg: None, "" and False)
+        return (value or False) == (current or False)
+
+    def _is_x2many_unchanged(self, value, current):
+        current = set(current or [])
+        if not value:
+            return not current
+        if all(isinstance(x, int) for x in value):
+            return set(value) == current
+        if len(value) == 1 and value[0][0] == 6:
+            return set(value[0][2]) == current
+        # only linking records already linked
+        return all(cmd[0] == 4 and cmd[1] in current for cmd in value)
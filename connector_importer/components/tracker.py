@@ -3,20 +3,36 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
 import logging
+from array import array
 
 from odoo.addons.component.core import Component
 
+from ..utils.import_utils import expand_report_items
+
 
 class ChunkReport(dict):
     """A smarter dict for chunk reports."""
 
-    chunk_report_keys = ("created", "updated", "errored", "skipped")
+    chunk_report_keys = ("created", "updated", "errored", "skipped", "unchanged")
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         for k in self.chunk_report_keys:
             self[k] = []
 
+    def _track_item(self, key, item):
+        self[key].append(item)
+
+    def discard_items(self, key, line_nr):
+        """Drop items tracked for given line number."""
+        self[key] = [x for x in self[key] if x["line_nr"] != line_nr]
+
+    def merge(self, report):
+        """Add items tracked by given report."""
+        for key in self.chunk_report_keys:
+            for item in report.get_items(key):
+                self._track_item(key, item)
+
     def track_error(self, item):
         self["errored"].append(item)
 
@@ -29,12 +45,79 @@ class ChunkReport(dict):
     def track_created(self, item):
         self["created"].append(item)
 
+    def track_unchanged(self, item):
+        self["unchanged"].append(item)
+
     def counters(self):
         res = {}
         for k, v in self.items():
             res[k] = len(v)
         return res
 
+    def get_items(self, key):
+        """Return the list of items tracked for given key."""
+        return self[key]
+
+    def to_report(self):
+        """Return report values to store."""
+        return dict(self)
+
+
+class CompactChunkReport(ChunkReport):
+    """A chunk report keeping only line numbers and ids of imported records.
+
+    Skipped and errored lines keep their full details.
+    """
+
+    compact_keys = ("created", "updated", "unchanged")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = ""
+        for k in self.compact_keys:
+            self[k] = {"line_nr": array("l"), "odoo_record": array("l")}
+
+    def _track_item(self, key, item):
+        if key not in self.compact_keys:
+            return super()._track_item(key, item)
+        self.model_name = item["model"]
+        self[key]["line_nr"].append(item["line_nr"])
+        self[key]["odoo_record"].append(item["odoo_record"] or 0)
+
+    def track_updated(self, item):
+        self._track_item("updated", item)
+
+    def track_created(self, item):
+        self._track_item("created", item)
+
+    def track_unchanged(self, item):
+        self._track_item("unchanged", item)
+
+    def discard_items(self, key, line_nr):
+        if key not in self.compact_keys:
+            return super().discard_items(key, line_nr)
+        keep = [i for i, x in enumerate(self[key]["line_nr"]) if x != line_nr]
+        for name, values in self[key].items():
+            self[key][name] = array("l", (values[i] for i in keep))
+
+    def counters(self):
+        res = super().counters()
+        for k in self.compact_keys:
+            res[k] = len(self[k]["line_nr"])
+        return res
+
+    def get_items(self, key):
+        return expand_report_items(self[key], model=self.model_name)
+
+    def to_report(self):
+        res = super().to_report()
+        for k in self.compact_keys:
+            res[k] = {
+                "line_nr": self[k]["line_nr"].tolist(),
+                "odoo_record": self[k]["odoo_record"].tolist(),
+            }
+        return res
+
 
 class Tracker(Component):
     """Track what happens during importer jobs."""
@@ -47,14 +130,26 @@ class Tracker(Component):
     logger_name = ""
     log_prefix = ""
     _chunk_report_klass = ChunkReport
+    _compact_chunk_report_klass = CompactChunkReport
+    _log_modes = ("line", "sample", "chunk")
+    _log_sample_rate = 100
 
     def _init_handler(self, model_name="", logger_name="", log_prefix=""):
         self.model_name = model_name
         self.logger_name = logger_name
         self.log_prefix = log_prefix
+        # validate options once, not on each line
+        self._log_mode = self._get_log_mode()
+        self._line_events_count = 0
 
     _logger = None
     _chunk_report = None
+    _log_mode = None
+    _line_events_count = 0
+    # chunk report and log calls put aside while a batch is running,
+    # see `begin_batch`
+    _batch_main_report = None
+    _batch_logs = None
 
     @property
     def logger(self):
@@ -62,10 +157,20 @@ class Tracker(Component):
             self._logger = logging.getLogger(self.logger_name)
         return self._logger
 
+    def use_compact_report(self):
+        """Tell if only ids of imported records must be tracked.
+
+        Enable it via `tracking_handler.compact_report` option.
+        """
+        return bool(self.work.options.tracking_handler.compact_report)
+
     @property
     def chunk_report(self):
-        if not self._chunk_report:
-            self._chunk_report = self._chunk_report_klass()
+        if self._chunk_report is None:
+            klass = self._chunk_report_klass
+            if self.use_compact_report():
+                klass = self._compact_chunk_report_klass
+            self._chunk_report = klass()
         return self._chunk_report
 
     def chunk_report_item(self, line, odoo_record=None, message=""):
@@ -76,19 +181,122 @@ class Tracker(Component):
             "odoo_record": odoo_record.id if odoo_record else None,
         }
 
-    def _log(self, msg, line=None, level="info"):
-        handler = getattr(self.logger, level)
-        msg = "{prefix}{line}[model: {model}] {msg}".format(
-            prefix=self.log_prefix,
-            line="[line: {}]".format(line["_line_nr"]) if line else "",
-            model=self.model_name,
-            msg=msg,
-        )
-        handler(msg)
+    @property
+    def log_mode(self):
+        """How line events (created, updated, etc) get logged.
+
+        Set it via `tracking_handler.log_mode` option:
+
+        * `line` (default): log every line
+        * `sample`: log 1 line every `tracking_handler.log_sample_rate`
+        * `chunk`: log only the summary of each chunk
+
+        Errors are always logged.
+        """
+        if self._log_mode is None:
+            self._log_mode = self._get_log_mode()
+        return self._log_mode
+
+    def _get_log_mode(self):
+        options = self.work.options.tracking_handler
+        mode = options.log_mode or "line"
+        if mode not in self._log_modes:
+            raise ValueError(
+                "Invalid tracking_handler.log_mode `{}`: use one of {}".format(
+                    mode, ", ".join(self._log_modes)
+                )
+            )
+        if mode == "sample":
+            self._log_sample_rate = options.log_sample_rate or self._log_sample_rate
+        return mode
+
+    def _should_log_line_event(self):
+        mode = self.log_mode
+        if mode == "chunk":
+            return False
+        if mode == "sample":
+            self._line_events_count += 1
+            return (self._line_events_count - 1) % self._log_sample_rate == 0
+        return True
+
+    def _log(self, msg, line=None, level="info", event=None, odoo_record=None, **kw):
+        """Log given message w/ structured data as `extra`.
+
+        Extra values are prefixed w/ `import_` to not clash
+        w/ `LogRecord` attributes, eg: `import_model`, `import_line_nr`.
+        """
+        levelno = self._log_levelno(level)
+        if levelno is None:
+            return
+        line_nr = line["_line_nr"] if line else None
+        extra = {
+            "import_event": event,
+            "import_model": self.model_name,
+            "import_line_nr": line_nr,
+            "import_record_id": odoo_record.id if odoo_record else None,
+        }
+        for key, value in kw.items():
+            extra["import_" + key] = value
+        if line:
+            fmt = "%s[line: %s][model: %s] %s"
+            args = (self.log_prefix, line_nr, self.model_name, msg)
+        else:
+            fmt = "%s[model: %s] %s"
+            args = (self.log_prefix, self.model_name, msg)
+        if self._batch_logs is not None:
+            self._batch_logs.append((levelno, fmt, args, extra))
+            return
+        self.logger.log(levelno, fmt, *args, extra=extra)
+
+    def begin_batch(self):
+        """Put aside what gets tracked until the batch ends.
+
+        Used by importers running lines in batches sharing the same savepoint:
+        if the batch is rolled back, its tracked items and logs are dropped
+        (see `discard_batch`), otherwise they're added to the chunk report
+        (see `end_batch`).
+        """
+        self._batch_main_report = self.chunk_report
+        self._chunk_report = None
+        self._batch_logs = []
+
+    def end_batch(self):
+        """Add items and logs of the current batch to the chunk."""
+        batch_report, logs = self._chunk_report, self._batch_logs
+        self._discard_batch_state()
+        if batch_report is not None:
+            self.chunk_report.merge(batch_report)
+        for levelno, fmt, args, extra in logs:
+            self.logger.log(levelno, fmt, *args, extra=extra)
+
+    def discard_batch(self):
+        """Drop items and logs of the current batch."""
+        self._discard_batch_state()
+
+    def _discard_batch_state(self):
+        self._chunk_report = self._batch_main_report
+        self._batch_main_report = None
+        self._batch_logs = None
+
+    def _log_levelno(self, level):
+        """Return the number of given level if enabled, None otherwise."""
+        levelno = logging.getLevelName(level.upper())
+        return levelno if self.logger.isEnabledFor(levelno) else None
+
+    def _log_line_event(self, event, line, odoo_record=None, message="", level="info"):
+        # build nothing if it's not going to be logged
+        if self._log_levelno(level) is None or not self._should_log_line_event():
+            return
+        msg = event.upper()
+        if odoo_record:
+            msg += " [id: {}]".format(odoo_record.id)
+        if message:
+            msg += " " + message
+        self._log(msg, line=line, level=level, event=event, odoo_record=odoo_record)
 
     def log_updated(self, values, line, odoo_record=None, message=""):
         if odoo_record:
-            self._log("UPDATED [id: {}]".format(odoo_record.id), line=line)
+            self._log_line_event("updated", line, odoo_record=odoo_record)
         self.chunk_report.track_updated(
             self.chunk_report_item(line, odoo_record=odoo_record, message=message)
         )
@@ -96,26 +304,52 @@ class Tracker(Component):
     def log_error(self, values, line, odoo_record=None, message=""):
         if isinstance(message, Exception):
             message = str(message)
-        self._log(message, line=line, level="error")
+        self._log(
+            message, line=line, level="error", event="errored", odoo_record=odoo_record
+        )
         self.chunk_report.track_error(
             self.chunk_report_item(line, odoo_record=odoo_record, message=message)
         )
 
     def log_created(self, values, line, odoo_record=None, message=""):
         if odoo_record:
-            self._log("CREATED [id: {}]".format(odoo_record.id), line=line)
+            self._log_line_event("created", line, odoo_record=odoo_record)
         self.chunk_report.track_created(
             self.chunk_report_item(line, odoo_record=odoo_record, message=message)
         )
 
     def log_skipped(self, values, line, skip_info):
         # `skip_it` could contain a msg
-        self._log("SKIPPED " + skip_info.get("message"), line=line, level="warn")
+        self._log_line_event(
+            "skipped", line, message=skip_info.get("message"), level="warn"
+        )
 
         item = self.chunk_report_item(line)
         item.update(skip_info)
         self.chunk_report.track_skipped(item)
 
+    def log_unchanged(self, values, line, odoo_record=None, message=""):
+        self._log_line_event("unchanged", line, level="debug")
+        self.chunk_report.track_unchanged(
+            self.chunk_report_item(line, odoo_record=odoo_record, message=message)
+        )
+
+    def untrack(self, key, line):
+        """Drop what was tracked for given line under given key.
+
+        Eg: a line tracked as created whose record has been removed.
+        """
+        self.chunk_report.discard_items(key, line["_line_nr"])
+
+    def log_summary(self, counters=None):
+        """Log the summary of the current chunk."""
+        counters = counters or self.get_counters()
+        msg = " ".join(
+            "[{}: {}]".format(key, counters.get(key, 0))
+            for key in self._chunk_report_klass.chunk_report_keys
+        )
+        self._log("CHUNK FINISHED " + msg, event="chunk_finished", **counters)
+
     def get_report(self, previous=None):
         previous = previous or {}
         # init a new report
@@ -123,7 +357,8 @@ class Tracker(Component):
         # merge previous and current
         for k, _v in report.items():
             prev = previous.get(self.model_name, {}).get(k, [])
-            report[k] = prev + self.chunk_report[k]
+            prev = expand_report_items(prev, model=self.model_name)
+            report[k] = prev + self.chunk_report.get_items(k)
         return report
 
     def get_counters(self):
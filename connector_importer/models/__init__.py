@@ -4,4 +4,6 @@ from . import import_type
 from . import sources
 from . import recordset
 from . import record
+from . import line_hash
+from . import report_chunk
 from . import reporter
@@ -35,7 +35,9 @@ class ImportType(models.Model):
         mapper:
           one: False
         tracking_handler:
-          one: False
+          # log: `line` (default), `sample` or `chunk` summary only
+          log_mode: sample
+          log_sample_rate: 1000
 
     - model: product.product
       importer: product.importer.component.name
@@ -83,6 +85,33 @@ class ImportType(models.Model):
         ),
         default=True,
     )
+    chunk_data_format = fields.Selection(
+        string="Chunk data format",
+        selection=[
+            ("json", "JSON"),
+            ("compact", "Compact"),
+            ("compact_zlib", "Compact and compressed"),
+        ],
+        default="json",
+        help=(
+            "How lines are stored on import records.\n"
+            "JSON: a list of dictionaries, one per line.\n"
+            "Compact: column names are stored once, "
+            "lines are stored as lists of values.\n"
+            "Compact and compressed: same as compact, compressed w/ zlib."
+        ),
+    )
+    split_batch_size = fields.Integer(
+        string="Split batch size",
+        help=(
+            "When the source is split into import records, commit them "
+            "every N chunks so that their jobs can start "
+            "while the rest of the source is still being split.\n"
+            "0 means all the records are committed at the end of the split.\n"
+            "Used only when jobs are enabled."
+        ),
+        default=0,
+    )
     _sql_constraints = [
         ("key_uniq", "unique (key)", "Import type `key` must be unique!")
     ]
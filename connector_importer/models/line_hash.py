@@ -0,0 +1,74 @@
+# Copyright 2018 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from psycopg2.extras import execute_values
+
+from odoo import fields, models
+
+
+class ImportLineHash(models.Model):
+    """Hash of the values last imported for a given unique key.
+
+    Used by importers w/ `importer.skip_unchanged_lines` option
+    to skip lines that did not change since the last successful import.
+    """
+
+    _name = "import.line.hash"
+    _description = "Import line hash"
+
+    type_id = fields.Many2one(
+        "import.type", string="Import type", required=True, ondelete="cascade"
+    )
+    model = fields.Char(required=True)
+    key = fields.Char(required=True)
+    hash = fields.Char(required=True)
+    res_id = fields.Integer(string="Record ID")
+
+    _sql_constraints = [
+        (
+            "type_model_key_uniq",
+            "unique(type_id, model, key)",
+            "A key can have only one hash by import type and model.",
+        )
+    ]
+
+    def _get_hashes(self, import_type, model, keys):
+        """Retrieve stored hashes for given keys.
+
+        :return: dictionary mapping each known key to a `(hash, res_id)` tuple.
+        """
+        if not keys:
+            return {}
+        self.env.cr.execute(
+            "SELECT key, hash, res_id FROM import_line_hash "
+            "WHERE type_id = %s AND model = %s AND key IN %s",
+            (import_type.id, model, tuple(keys)),
+        )
+        return {key: (hash_, res_id) for key, hash_, res_id in self.env.cr.fetchall()}
+
+    def _set_hashes(self, import_type, model, rows):
+        """Insert or update hashes.
+
+        :param rows: list of `(key, hash, res_id)` tuples.
+        """
+        if not rows:
+            return
+        query = (
+            "INSERT INTO import_line_hash "
+            "(type_id, model, key, hash, res_id, "
+            "create_uid, create_date, write_uid, write_date) "
+            "VALUES %s "
+            "ON CONFLICT (type_id, model, key) DO UPDATE "
+            "SET hash = EXCLUDED.hash, res_id = EXCLUDED.res_id, "
+            "write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date"
+        )
+        now = "now() at time zone 'UTC'"
+        template = "(%s, %s, %s, %s, %s, %s, {now}, %s, {now})".format(now=now)
+        # one row per key or postgres refuses to update the same row twice
+        by_key = {key: (hash_, res_id) for key, hash_, res_id in rows}
+        values = [
+            (import_type.id, model, key, hash_, res_id, self.env.uid, self.env.uid)
+            for key, (hash_, res_id) in by_key.items()
+        ]
+        execute_values(self.env.cr._obj, query, values, template=template)
+        self.invalidate_cache()
@@ -5,12 +5,17 @@
 import base64
 import json
 import os
+import zlib
+
+from psycopg2.extras import execute_values
 
 from odoo import api, fields, models
 
+from odoo.addons.base_sparse_field.models.fields import Serialized
 from odoo.addons.queue_job.job import job
 
 from ..log import logger
+from ..utils.import_utils import compact_lines, expand_lines, is_compact_payload
 from .job_mixin import JobRelatedMixin
 
 
@@ -22,6 +27,10 @@ class ImportRecord(models.Model, JobRelatedMixin):
     Depending on backend settings you gonna have one or more source records
     stored as JSON data into `jsondata` field.
 
+    If the source supports it, only a reference to the chunk of lines
+    is stored into `chunk_ref` field and lines are read back from the source
+    when the import runs.
+
     No matter where you are importing from (CSV, SQL, etc)
     the importer machinery will:
 
@@ -42,6 +51,9 @@ class ImportRecord(models.Model, JobRelatedMixin):
     # This field holds the whole bare data to import from the external source
     # hence it can be huge. For this reason we store it in an attachment.
     jsondata_file = fields.Binary(attachment=True)
+    # Reference to the chunk of lines in the source (offsets, lines range,
+    # checksum...) used instead of `jsondata_file` if the source supports it.
+    chunk_ref = Serialized()
     recordset_id = fields.Many2one("import.recordset", string="Recordset")
     backend_id = fields.Many2one(
         "import.backend",
@@ -60,19 +72,80 @@ class ImportRecord(models.Model, JobRelatedMixin):
             names = [item.date]
             item.name = " / ".join([_f for _f in names if _f])
 
-    def set_data(self, adict):
+    def set_data(self, adict, data_format=None):
+        """Store lines to import.
+
+        :param adict: list of lines
+        :param data_format: one of `import.type.chunk_data_format` values.
+            Defaults to the format of the import type.
+        """
         self.ensure_one()
-        jsondata = json.dumps(adict)
-        self.jsondata_file = base64.b64encode(bytes(jsondata, "utf-8"))
+        data_format = data_format or self.recordset_id.import_type_id.chunk_data_format
+        self.jsondata_file = self._prepare_data(adict, data_format=data_format)
+
+    @api.model
+    def _prepare_data(self, adict, data_format=None):
+        """Encode lines to be stored into `jsondata_file`."""
+        data_format = data_format or "json"
+        if data_format in ("compact", "compact_zlib"):
+            adict = compact_lines(adict)
+        data = bytes(json.dumps(adict), "utf-8")
+        if data_format == "compact_zlib":
+            data = zlib.compress(data)
+        return base64.b64encode(data)
+
+    def _load_data(self):
+        data = base64.b64decode(self.jsondata_file)
+        # JSON data can start only w/ `[` or `{`, `x` is zlib header
+        if data[:1] == b"x":
+            data = zlib.decompress(data)
+        return json.loads(data.decode("utf-8"))
 
     def get_data(self):
         self.ensure_one()
+        if self.chunk_ref:
+            return list(self.iter_data())
         jsondata = None
         if self.jsondata_file:
-            raw_data = base64.b64decode(self.jsondata_file).decode("utf-8")
-            jsondata = json.loads(raw_data)
+            jsondata = self._load_data()
+            if is_compact_payload(jsondata):
+                jsondata = list(expand_lines(jsondata))
         return jsondata or {}
 
+    def set_data_ref(self, source, ref):
+        """Store a reference to a chunk of `source` lines."""
+        self.ensure_one()
+        self.chunk_ref = self._prepare_data_ref(source, ref)
+
+    @api.model
+    def _prepare_data_ref(self, source, ref):
+        return dict(ref, source_model=source._name, source_id=source.id)
+
+    def get_data_source(self):
+        self.ensure_one()
+        ref = self.chunk_ref
+        return self.env[ref["source_model"]].browse(ref["source_id"])
+
+    def iter_data(self):
+        """Iterate over lines to import.
+
+        When the record holds only a reference to its chunk
+        lines are read lazily from the source.
+        Compact data is turned back into dictionaries line by line.
+        """
+        self.ensure_one()
+        if self.chunk_ref:
+            yield from self.get_data_source().get_lines_by_ref(self.chunk_ref)
+            return
+        if not self.jsondata_file:
+            return
+        jsondata = self._load_data()
+        if is_compact_payload(jsondata):
+            # lines are turned into dictionaries only when consumed
+            yield from expand_lines(jsondata)
+        else:
+            yield from jsondata or []
+
     def debug_mode(self):
         self.ensure_one()
         return self.backend_id.debug_mode or os.environ.get("IMPORTER_DEBUG_MODE")
@@ -99,7 +172,12 @@ class ImportRecord(models.Model, JobRelatedMixin):
 
     def run_import(self):
         """ queue a job for importing data stored in to self
+
+        When called on several records jobs are enqueued
+        and linked to their records in bulk.
         """
+        if len(self) > 1:
+            return self._run_import_multi()
         self.ensure_one()
         use_job = self.recordset_id.import_type_id.use_job
         # TODO: use ctx key to disable job instead
@@ -111,6 +189,53 @@ class ImportRecord(models.Model, JobRelatedMixin):
         result = self._run_import(job_method, use_job)
         return result
 
+    def _run_import_multi(self):
+        res = {}
+        jobs = {}
+        for recordset in self.mapped("recordset_id"):
+            records = self.filtered(lambda x: x.recordset_id == recordset)
+            use_job = recordset.import_type_id.use_job
+            if recordset.debug_mode() or not use_job:
+                for record in records:
+                    res[record.id] = record.run_import()
+                continue
+            configs = list(recordset.available_importers())
+            for record in records:
+                res[record.id] = {}
+                for config in configs:
+                    job = record.with_delay().import_record(config)
+                    res[record.id][config.model] = job
+                    # FIXME: same as `_run_import`, we keep only the last job
+                    jobs[record.id] = job.uuid
+        if jobs:
+            self._link_jobs(jobs)
+        return res
+
+    def _link_jobs(self, jobs):
+        """Link jobs to records w/ one query.
+
+        :param jobs: dictionary mapping record ids to job uuids
+        """
+        job_ids = {
+            x["uuid"]: x["id"]
+            for x in self.env["queue.job"].search_read(
+                [("uuid", "in", list(jobs.values()))], ["uuid"]
+            )
+        }
+        values = [
+            (record_id, job_ids[uuid])
+            for record_id, uuid in jobs.items()
+            if uuid in job_ids
+        ]
+        self.flush(["job_id"])
+        query = (
+            "UPDATE import_record SET job_id = data.job_id "
+            "FROM (VALUES %s) AS data(id, job_id) "
+            "WHERE import_record.id = data.id"
+        )
+        execute_values(self.env.cr._obj, query, values)
+        self.invalidate_cache(["job_id", "job_state"])
+
     def _run_import(self, job_method, use_job):
         res = {}
         # we create a record and a job for each model name
@@ -12,6 +12,7 @@ from odoo.addons.base_sparse_field.models.fields import Serialized
 from odoo.addons.queue_job.job import DONE, STATES, job
 
 from ..log import logger
+from ..utils.import_utils import count_report_items, expand_report_items
 from .job_mixin import JobRelatedMixin
 
 
@@ -28,7 +29,7 @@ class ImportRecordset(models.Model, JobRelatedMixin):
     information about imports:
 
     * required fields, translatable fields, defaults
-    * import stats (created|updated|skipped|errored counters, latest run)
+    * import stats (created|updated|skipped|errored|unchanged counters, latest run)
     * fully customizable HTML report to provide more details
     * downloadable report file (via reporters)
     * global states of running jobs
@@ -62,6 +63,10 @@ class ImportRecordset(models.Model, JobRelatedMixin):
     record_ids = fields.One2many("import.record", "recordset_id", string="Records")
     # store info about imports report
     report_data = Serialized()
+    # reports of each imported chunk, merged into `report_data` when read
+    report_chunk_ids = fields.One2many(
+        "import.report.chunk", "recordset_id", string="Chunk reports"
+    )
     shared_data = Serialized()
     report_html = fields.Html("Report summary", compute="_compute_report_html")
     full_report_url = fields.Char("Full report url", compute="_compute_full_report_url")
@@ -115,13 +120,78 @@ class ImportRecordset(models.Model, JobRelatedMixin):
         self.invalidate_cache((fname,))
 
     def set_report(self, values, reset=False):
-        """Update import report values."""
+        """Update import report values.
+
+        On reset, chunk reports are dropped too.
+        """
         self.ensure_one()
+        if reset:
+            self._drop_chunk_reports()
         self._set_serialized("report_data", values, reset=reset)
 
     def get_report(self):
+        """Return import report values merged w/ chunk reports."""
+        self.ensure_one()
+        report = dict(self.report_data or {})
+        chunks = self.env["import.report.chunk"].search_read(
+            [("recordset_id", "=", self.id)], ["model", "report_data"], order="id"
+        )
+        merged = {}
+        for chunk in chunks:
+            model = chunk["model"]
+            if model not in merged:
+                # copy lists to not alter `report_data`
+                merged[model] = report[model] = {
+                    key: list(items) for key, items in report.get(model, {}).items()
+                }
+            for key, items in (chunk["report_data"] or {}).items():
+                items = expand_report_items(items, model=model)
+                merged[model].setdefault(key, []).extend(items)
+        return report
+
+    def add_chunk_report(self, model, values, record=None, counters=None):
+        """Append the report of a chunk of lines for given model.
+
+        :param model: name of the imported model
+        :param values: dictionary of report items by key (created, updated, etc)
+        :param record: the `import.record` holding the chunk
+        :param counters: dictionary of counters by key,
+            computed from `values` if not given.
+        """
+        self.ensure_one()
+        chunk_model = self.env["import.report.chunk"]
+        if counters is None:
+            counters = {key: count_report_items(items) for key, items in values.items()}
+        vals = {
+            "recordset_id": self.id,
+            "record_id": record.id if record else False,
+            "model": model,
+            "report_data": values,
+        }
+        for key in chunk_model._counter_keys:
+            vals[key] = counters.get(key, 0)
+        chunk_model.create(vals)
+
+    def get_report_counters(self):
+        """Return report counters by model w/o loading all report items."""
         self.ensure_one()
-        return self.report_data or {}
+        res = {}
+        for model, report in (self.report_data or {}).items():
+            if isinstance(report, dict):
+                res[model] = {
+                    key: count_report_items(items) for key, items in report.items()
+                }
+        counters = self.env["import.report.chunk"]._get_counters(self)
+        for model, model_counters in counters.items():
+            res.setdefault(model, {})
+            for key, count in model_counters.items():
+                res[model][key] = res[model].get(key, 0) + count
+        return res
+
+    def _drop_chunk_reports(self):
+        self.env["import.report.chunk"].search(
+            [("recordset_id", "in", self.ids)]
+        ).unlink()
 
     def set_shared(self, values, reset=False):
         """Update import report values."""
@@ -145,6 +215,7 @@ class ImportRecordset(models.Model, JobRelatedMixin):
             "report_data": report_data,
             "shared_data": {},
         }
+        self._drop_chunk_reports()
         self.write(values)
         self.invalidate_cache(tuple(values.keys()))
 
@@ -166,28 +237,26 @@ class ImportRecordset(models.Model, JobRelatedMixin):
                     }
                 }
         """
-        report = self.get_report()
+        counters = self.get_report_counters()
         data = {
             "recordset": self,
-            "last_start": report.pop("_last_start"),
+            "last_start": (self.report_data or {}).get("_last_start"),
             "report_by_model": OrderedDict(),
         }
         # count keys by model
         for config in self.available_importers():
             model = self.env["ir.model"]._get(config.model)
-            data["report_by_model"][model] = {}
             # be defensive here. At some point
             # we could decide to skip models on demand.
-            for k, v in report.get(config.model, {}).items():
-                data["report_by_model"][model][k] = len(v)
+            data["report_by_model"][model] = counters.get(config.model, {})
         return data
 
-    @api.depends("report_data")
+    @api.depends("report_data", "report_chunk_ids")
     def _compute_report_html(self):
         template = self.env.ref("connector_importer.recordset_report")
         for item in self:
             item.report_html = False
-            if not item.report_data:
+            if not item.report_data and not item.report_chunk_ids:
                 continue
             data = item._get_report_html_data()
             item.report_html = template.render(data)
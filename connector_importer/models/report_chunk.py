@@ -0,0 +1,59 @@
+# Copyright 2018 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from odoo import fields, models
+
+from odoo.addons.base_sparse_field.models.fields import Serialized
+
+
+class ImportReportChunk(models.Model):
+    """Report of a chunk of lines imported for a given model.
+
+    Each import job appends its own report here instead of rewriting
+    the whole recordset report: reports are aggregated only when read
+    (see `import.recordset.get_report`).
+    """
+
+    _name = "import.report.chunk"
+    _description = "Import chunk report"
+    _order = "id"
+
+    recordset_id = fields.Many2one(
+        "import.recordset",
+        string="Recordset",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    record_id = fields.Many2one(
+        "import.record", string="Import record", ondelete="set null"
+    )
+    model = fields.Char(required=True)
+    report_data = Serialized()
+    # counters are stored apart to be summed up w/o loading report items
+    created = fields.Integer()
+    updated = fields.Integer()
+    errored = fields.Integer()
+    skipped = fields.Integer()
+    unchanged = fields.Integer()
+
+    _counter_keys = ("created", "updated", "errored", "skipped", "unchanged")
+
+    def _get_counters(self, recordset):
+        """Sum up counters of given recordset by model.
+
+        :return: dictionary of counters by key, by model.
+        """
+        self.flush(["recordset_id", "model"] + list(self._counter_keys))
+        # the query construction is not vulnerable to SQL injection, as we are
+        # replacing the column names here.
+        # pylint: disable=sql-injection
+        query = (
+            "SELECT model, {} FROM import_report_chunk "
+            "WHERE recordset_id = %s GROUP BY model"
+        ).format(", ".join("SUM({})".format(key) for key in self._counter_keys))
+        self.env.cr.execute(query, (recordset.id,))
+        return {
+            row[0]: dict(zip(self._counter_keys, (x or 0 for x in row[1:])))
+            for row in self.env.cr.fetchall()
+        }
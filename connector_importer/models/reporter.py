@@ -139,8 +139,13 @@ class CSVReporter(models.AbstractModel):
 
         source = recordset.get_source()
         csv_file_bin = base64.b64decode(source.csv_file)
-        # Try to guess the encoding of the file supplied
-        csv_file_encoding = get_encoding(csv_file_bin).get("encoding", "utf-8")
+        # Try to guess the encoding of the file supplied if not known yet
+        csv_file_encoding = (
+            source.csv_encoding
+            or (source.csv_metadata or {}).get("encoding")
+            or get_encoding(csv_file_bin).get("encoding")
+            or "utf-8"
+        )
         orig_content = csv_file_bin.decode(csv_file_encoding).splitlines()
         delimiter = source.csv_delimiter
         quotechar = source.csv_quotechar
@@ -3,10 +3,20 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
 import base64
+import io
 
-from odoo import api, fields, models
+from odoo import _, api, exceptions, fields, models
 
-from ...utils.import_utils import CSVReader, guess_csv_metadata
+from odoo.addons.base_sparse_field.models.fields import Serialized
+
+from ...utils.import_utils import (
+    CSVMmapReader,
+    CSVReader,
+    CSVStreamReader,
+    check_sampled_encoding,
+    get_csv_metadata,
+    get_encoding,
+)
 
 
 class CSVSource(models.Model):
@@ -26,7 +36,37 @@ class CSVSource(models.Model):
     csv_path = fields.Char("CSV path")
     csv_delimiter = fields.Char(string="CSV delimiter", default=";")
     csv_quotechar = fields.Char(string="CSV quotechar", default='"')
-    csv_encoding = fields.Char(string="CSV Encoding")
+    csv_encoding = fields.Char(
+        string="CSV Encoding",
+        help="Automatically detected when a new file is loaded, if empty.",
+    )
+    csv_read_mode = fields.Selection(
+        string="CSV read mode",
+        selection=[
+            ("memory", "Load in memory"),
+            ("stream", "Stream"),
+            ("mmap", "Memory-mapped"),
+        ],
+        default="memory",
+        required=True,
+        help=(
+            "Load in memory: the whole file is loaded and decoded at once.\n"
+            "Stream: the file is decoded and parsed line by line, "
+            "memory usage does not depend on the file size.\n"
+            "Memory-mapped: the file is mapped in memory and its lines "
+            "indexed once, chunks are then decoded straight from the file. "
+            "Requires a file on disk and an ASCII compatible encoding."
+        ),
+    )
+    # Metadata of the loaded file (checksum, size, encoding, dialect, header,
+    # lines count) computed once when the file changes. See `get_csv_metadata`.
+    csv_metadata = Serialized()
+    csv_checksum = fields.Char(
+        string="CSV checksum", compute="_compute_csv_metadata_info", readonly=True
+    )
+    csv_line_count = fields.Integer(
+        string="CSV lines", compute="_compute_csv_metadata_info", readonly=True
+    )
     # Handy fields to get a downloadable example file
     example_file_ext_id = fields.Char(
         help=(
@@ -42,6 +82,8 @@ class CSVSource(models.Model):
     )
 
     _csv_reader_klass = CSVReader
+    _csv_stream_reader_klass = CSVStreamReader
+    _csv_mmap_reader_klass = CSVMmapReader
 
     @property
     def _config_summary_fields(self):
@@ -52,19 +94,83 @@ class CSVSource(models.Model):
             "csv_delimiter",
             "csv_quotechar",
             "csv_encoding",
+            "csv_read_mode",
+            "csv_checksum",
+            "csv_line_count",
         ]
 
+    # bytes analyzed to detect the encoding, see `get_encoding`
+    _csv_encoding_sample_size = 64 * 1024
+
     def _binary_csv_content(self):
         return base64.b64decode(self.csv_file)
 
+    def _guess_csv_encoding(self, content):
+        encoding = get_encoding(content, sample_size=self._csv_encoding_sample_size)
+        return check_sampled_encoding(encoding["encoding"], io.BytesIO(content))
+
+    def _get_csv_metadata(self, content, encoding=None):
+        encoding = encoding or self._guess_csv_encoding(content)
+        return get_csv_metadata(content, encoding=encoding)
+
+    @api.model
+    def create(self, vals):
+        self._fill_csv_metadata(vals)
+        return super().create(vals)
+
+    def write(self, vals):
+        if "csv_metadata" in vals:
+            return super().write(vals)
+        if "csv_file" in vals and not vals["csv_file"]:
+            # file removed: its metadata is gone too
+            return super().write(dict(vals, csv_metadata=False))
+        if not vals.get("csv_file"):
+            return super().write(vals)
+        vals = dict(vals)
+        encoding_provided = "csv_encoding" in vals
+        self._fill_csv_metadata(vals)
+        if encoding_provided:
+            return super().write(vals)
+        # store the detected encoding only where it's missing
+        encoding = vals.pop("csv_encoding")
+        to_fill = self.filtered(lambda x: not x.csv_encoding)
+        res = super().write(vals)
+        if encoding and to_fill:
+            super(CSVSource, to_fill).write({"csv_encoding": encoding})
+        return res
+
+    def _fill_csv_metadata(self, vals):
+        """Collect and store metadata once when a file is loaded.
+
+        The encoding is detected only if not provided.
+        """
+        if vals.get("csv_file") and "csv_metadata" not in vals:
+            content = base64.b64decode(vals["csv_file"])
+            meta = self._get_csv_metadata(content, encoding=vals.get("csv_encoding"))
+            vals["csv_metadata"] = meta
+            vals["csv_encoding"] = vals.get("csv_encoding") or meta["encoding"]
+
     @api.onchange("csv_file")
     def _onchange_csv_file(self):
         if self.csv_file:
-            # auto-guess CSV details
-            meta = guess_csv_metadata(self._binary_csv_content())
-            if meta:
+            # auto-guess CSV details, keep the encoding if any as `write` does
+            meta = self._get_csv_metadata(
+                self._binary_csv_content(), encoding=self.csv_encoding
+            )
+            self.csv_metadata = meta
+            self.csv_encoding = self.csv_encoding or meta["encoding"]
+            if meta["delimiter"]:
                 self.csv_delimiter = meta["delimiter"]
                 self.csv_quotechar = meta["quotechar"]
+        else:
+            self.csv_metadata = False
+
+    @api.depends("csv_metadata")
+    def _compute_csv_metadata_info(self):
+        for item in self:
+            meta = item.csv_metadata or {}
+            item.csv_checksum = meta.get("checksum")
+            item.csv_line_count = meta.get("line_count")
 
     @api.depends("csv_file")
     def _compute_csv_filesize(self):
@@ -74,9 +180,39 @@ class CSVSource(models.Model):
                 # in v11 binary fields now can return the size of the file
                 item.csv_filesize = self.with_context(bin_size=True).csv_file
 
+    def _csv_file_path(self):
+        """Return the filestore path of `csv_file` if any."""
+        attachment = (
+            self.env["ir.attachment"]
+            .sudo()
+            .search(
+                [
+                    ("res_model", "=", self._name),
+                    ("res_field", "=", "csv_file"),
+                    ("res_id", "=", self.id),
+                ],
+                limit=1,
+            )
+        )
+        if attachment.store_fname:
+            return attachment._full_path(attachment.store_fname)
+        return None
+
+    def _csv_reader_args(self):
+        # same dialect for every read mode
+        return {
+            "delimiter": self.csv_delimiter,
+            "quotechar": self.csv_quotechar or '"',
+            "encoding": self.csv_encoding,
+        }
+
     def _get_lines(self):
         # read CSV
-        reader_args = {"delimiter": self.csv_delimiter, "encoding": self.csv_encoding}
+        reader_args = self._csv_reader_args()
+        if self.csv_read_mode == "stream":
+            return self._get_lines_stream(reader_args)
+        if self.csv_read_mode == "mmap":
+            return self._get_mmap_reader().read_lines()
         if self.csv_path:
             # TODO: join w/ filename
             reader_args["filepath"] = self.csv_path
@@ -86,6 +222,55 @@ class CSVSource(models.Model):
         reader = self._csv_reader_klass(**reader_args)
         return reader.read_lines()
 
+    def _get_lines_stream(self, reader_args):
+        if self.csv_path:
+            reader_args["filepath"] = self.csv_path
+        else:
+            # read straight from the filestore when possible
+            filepath = self._csv_file_path()
+            if filepath:
+                reader_args["filepath"] = filepath
+            else:
+                reader_args["filedata"] = base64.decodebytes(self.csv_file)
+        reader = self._csv_stream_reader_klass(**reader_args)
+        return reader.read_lines()
+
+    def _get_mmap_reader(self):
+        filepath = self.csv_path or self._csv_file_path()
+        if not filepath:
+            raise exceptions.UserError(
+                _("Memory-mapped read mode requires a file stored on disk.")
+            )
+        return self._csv_mmap_reader_klass(filepath=filepath, **self._csv_reader_args())
+
+    def use_chunk_refs(self):
+        return self.csv_read_mode == "mmap"
+
+    def get_chunk_refs(self):
+        if self.csv_read_mode != "mmap":
+            return super().get_chunk_refs()
+        reader = self._get_mmap_reader()
+        for ref in reader.chunk_ranges(self.chunk_size):
+            ref["checksum"] = reader.range_checksum(
+                ref["offset_from"], ref["offset_to"]
+            )
+            yield ref
+
+    def get_lines_by_ref(self, ref):
+        if self.csv_read_mode != "mmap":
+            return super().get_lines_by_ref(ref)
+        reader = self._get_mmap_reader()
+        checksum = reader.range_checksum(ref["offset_from"], ref["offset_to"])
+        if ref.get("checksum") and ref["checksum"] != checksum:
+            raise exceptions.UserError(
+                _("Source file changed: lines {}-{} cannot be read.").format(
+                    ref["line_from"], ref["line_to"]
+                )
+            )
+        return reader.read_range(
+            ref["offset_from"], ref["offset_to"], line_from=ref["line_from"]
+        )
+
     def _get_example_attachment(self):
         self.ensure_one()
         xmlid = self.example_file_ext_id
@@ -102,6 +102,28 @@ class ImportSource(models.AbstractModel):
         """Your duty here..."""
         raise NotImplementedError()
 
+    def use_chunk_refs(self):
+        """Tell if import records should store chunk references.
+
+        When enabled, import records store only a reference
+        to their chunk (see `get_chunk_refs`) instead of a copy of the lines,
+        and importers read the lines back from the source.
+        """
+        return False
+
+    def get_chunk_refs(self):
+        """Yield references to chunks of lines instead of the lines themselves.
+
+        A reference is a JSON-serializable dictionary
+        that `get_lines_by_ref` can turn back into the lines of the chunk.
+        Override it if your source can re-read a portion of its lines cheaply.
+        """
+        raise NotImplementedError()
+
+    def get_lines_by_ref(self, ref):
+        """Retrieve the lines of the chunk matching given reference."""
+        raise NotImplementedError()
+
     def _sort_lines(self, lines):
         """Override to customize sorting."""
         return lines
@@ -1,6 +1,7 @@
 from . import test_backend
 from . import test_cron
 from . import test_import_type
+from . import test_mapper_utils
 from . import test_recordset
 from . import test_record_importer
 from . import test_record_importer_basic
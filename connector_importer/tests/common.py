@@ -42,6 +42,9 @@ class MockedSource(object):
     def get_lines(self):
         return gen_chunks(self.lines, self.chunks_size)
 
+    def use_chunk_refs(self):
+        return False
+
 
 def fake_lines(count, keys):
     """Generate importable fake lines."""
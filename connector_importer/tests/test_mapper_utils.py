@@ -0,0 +1,51 @@
+# Copyright 2018 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import odoo.tests.common as common
+
+from ..utils.mapper_utils import (
+    DateConverter,
+    UTCDatetimeConverter,
+    convert,
+    to_date,
+    to_utc_datetime,
+)
+
+
+class TestMapperUtils(common.SavepointCase):
+    def test_to_date(self):
+        self.assertEqual(to_date("31/12/2020"), "2020-12-31")
+        self.assertIsNone(to_date("00/00/0000"))
+        # ISO strings are converted only w/ the right format
+        self.assertIsNone(to_date("2020-12-31"))
+        self.assertEqual(to_date("2020-12-31", formats=("%Y-%m-%d",)), "2020-12-31")
+
+    def test_to_utc_datetime(self):
+        # summer time in Rome
+        self.assertEqual(to_utc_datetime("2020-07-01 12:00:00"), "2020-07-01 10:00:00")
+        # tz is honored
+        self.assertEqual(
+            to_utc_datetime("2020-07-01 12:00:00", tz="UTC"), "2020-07-01 12:00:00"
+        )
+        self.assertIsNone(to_utc_datetime("00/00/0000"))
+
+    def test_date_converter_learning(self):
+        converter = DateConverter(formats=("%Y%m%d", "%d/%m/%Y"))
+        self.assertEqual(converter("01/02/2020"), "2020-02-01")
+        self.assertEqual(converter._last_format, "%d/%m/%Y")
+        self.assertEqual(converter("20200201"), "2020-02-01")
+        self.assertEqual(converter._last_format, "%Y%m%d")
+        self.assertIsNone(converter("foo"))
+
+    def test_converter_iso(self):
+        converter = DateConverter(iso=True)
+        self.assertEqual(converter("2020-12-31"), "2020-12-31")
+        self.assertEqual(converter("31/12/2020"), "2020-12-31")
+        converter = UTCDatetimeConverter(tz="UTC", iso=True)
+        self.assertEqual(converter("2020-07-01T12:00:00"), "2020-07-01 12:00:00")
+        self.assertEqual(converter("2020-07-01 12:00:00"), "2020-07-01 12:00:00")
+
+    def test_convert_date(self):
+        modifier = convert("date_start", "utc_date", tz="UTC")
+        record = {"_line_nr": 1, "date_start": "2020-07-01 12:00:00"}
+        self.assertEqual(modifier(None, record, "date"), "2020-07-01 12:00:00")
@@ -2,6 +2,8 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import mock
+
 from odoo.tools import mute_logger
 
 from .common import TestImporterBase
@@ -40,13 +42,43 @@ class TestRecordImporter(TestImporterBase):
         # in any case we'll get this per each model if the import is not broken
         model = "res.partner"
         expected = {
-            model: {"created": 10, "errored": 0, "updated": 0, "skipped": 0},
+            model: {
+                "created": 10,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
         }
         self.assertEqual(res, expected)
         for k, v in expected[model].items():
             self.assertEqual(len(report[model][k]), v)
         self.assertEqual(self.env[model].search_count([("ref", "like", "id_%")]), 10)
 
+    @mute_logger("[importer]")
+    def test_importer_create_compact_data(self):
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        # lines w/ different keys are kept as they are
+        lines[1].pop("id")
+        for data_format in ("compact", "compact_zlib"):
+            self.record.set_data(lines, data_format=data_format)
+            self.assertEqual(self.record.get_data(), lines)
+            self.assertEqual(list(self.record.iter_data()), lines)
+        self.import_type.chunk_data_format = "compact_zlib"
+        self.record.set_data(self.fake_lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 10,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+
     @mute_logger("[importer]")
     def test_importer_skip(self):
         # generate 10 records
@@ -59,7 +91,15 @@ class TestRecordImporter(TestImporterBase):
         res = self.record.run_import()
         report = self.recordset.get_report()
         model = "res.partner"
-        expected = {model: {"created": 8, "errored": 0, "updated": 0, "skipped": 2}}
+        expected = {
+            model: {
+                "created": 8,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 2,
+                "unchanged": 0,
+            }
+        }
         self.assertEqual(res, expected)
         for k, v in expected[model].items():
             self.assertEqual(len(report[model][k]), v)
@@ -79,7 +119,15 @@ class TestRecordImporter(TestImporterBase):
         res = self.record.run_import()
         report = self.recordset.get_report()
         model = "res.partner"
-        expected = {model: {"created": 10, "errored": 0, "updated": 0, "skipped": 0}}
+        expected = {
+            model: {
+                "created": 10,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
         self.assertEqual(res, expected)
         for k, v in expected[model].items():
             self.assertEqual(len(report[model][k]), v)
@@ -89,7 +137,15 @@ class TestRecordImporter(TestImporterBase):
         self.recordset.set_report({}, reset=True)
         res = self.record.run_import()
         report = self.recordset.get_report()
-        expected = {model: {"created": 0, "errored": 0, "updated": 10, "skipped": 0}}
+        expected = {
+            model: {
+                "created": 0,
+                "errored": 0,
+                "updated": 10,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
         self.assertEqual(res, expected)
         for k, v in expected[model].items():
             self.assertEqual(len(report[model][k]), v)
@@ -99,9 +155,440 @@ class TestRecordImporter(TestImporterBase):
         report = self.recordset.override_existing = False
         res = self.record.run_import()
         report = self.recordset.get_report()
-        expected = {model: {"created": 0, "errored": 0, "updated": 0, "skipped": 10}}
+        expected = {
+            model: {
+                "created": 0,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 10,
+                "unchanged": 0,
+            }
+        }
         self.assertEqual(res, expected)
         for k, v in expected[model].items():
             self.assertEqual(len(report[model][k]), v)
         skipped_msg1 = report[model]["skipped"][0]["message"]
         self.assertEqual(skipped_msg1, "ALREADY EXISTS: ref=id_1")
+
+    @mute_logger("[importer]")
+    def test_importer_update_lookup_index(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_lookup_index: True
+        """
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        # same unique key twice: the 2nd line must update the 1st record
+        lines[-1]["id"] = lines[0]["id"]
+        self.record.set_data(lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 9,
+                "errored": 0,
+                "updated": 1,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        self.recordset.set_report({}, reset=True)
+        res = self.record.run_import()
+        expected = {
+            model: {
+                "created": 0,
+                "errored": 0,
+                "updated": 10,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        self.assertEqual(self.env[model].search_count([("ref", "like", "id_%")]), 9)
+
+    @mute_logger("[importer]")
+    def test_importer_create_batch(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_batch_create: True
+        """
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        # same unique key twice: the 2nd line must update the 1st record
+        lines[-1]["id"] = lines[0]["id"]
+        self.record.set_data(lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 9,
+                "errored": 0,
+                "updated": 1,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        report = self.recordset.get_report()
+        created_ids = [x["odoo_record"] for x in report[model]["created"]]
+        partners = self.env[model].browse(created_ids)
+        self.assertEqual(len(partners.exists()), 9)
+        self.assertEqual(
+            sorted(partners.mapped("ref")), sorted({x["id"] for x in lines})
+        )
+
+    @mute_logger("[importer]")
+    def test_importer_create_batch_fallback(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_batch_create: True
+        """
+        self.record.set_data(self._fake_lines(3, keys=("id", "fullname")))
+        from ..components.odoorecord import OdooRecordHandler
+
+        partner_model = type(self.env["res.partner"])
+        orig_create = partner_model.create
+
+        def create(records, vals_list):
+            vals = vals_list if isinstance(vals_list, list) else [vals_list]
+            if any(x.get("ref") == "id_2" for x in vals):
+                raise ValueError("Broken line")
+            return orig_create(records, vals_list)
+
+        with mock.patch.object(
+            partner_model, "create", autospec=True, side_effect=create
+        ), mock.patch.object(
+            OdooRecordHandler, "odoo_pre_create", autospec=True
+        ) as pre_create:
+            res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 2,
+                "errored": 1,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        # once per line, even if the batch fell back to single creates
+        self.assertEqual(pre_create.call_count, 3)
+
+    @mute_logger("[importer]")
+    def test_importer_create_batch_no_override(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_batch_create: True
+        """
+        self.recordset.override_existing = False
+        lines = self._fake_lines(3, keys=("id", "fullname"))
+        # same unique key twice: the 2nd line must be skipped
+        lines[-1]["id"] = lines[0]["id"]
+        self.record.set_data(lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 2,
+                "errored": 0,
+                "updated": 0,
+                "skipped": 1,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        partner = self.env[model].search([("ref", "=", lines[0]["id"])])
+        self.assertEqual(partner.name, lines[0]["fullname"])
+
+    @mute_logger("[importer]")
+    def test_importer_create_batch_savepoint_split(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    importer:
+      savepoint_batch_size: 4
+    record_handler:
+      use_batch_create: True
+        """
+        self.record.set_data(self._fake_lines(8, keys=("id", "fullname")))
+        from .fake_components import PartnerMapper
+
+        orig_finalize = PartnerMapper.finalize
+
+        def finalize(mapper, map_record, values):
+            if values.get("ref") in ("id_2", "id_4"):
+                raise ValueError("Broken line")
+            return orig_finalize(mapper, map_record, values)
+
+        # 1st batch is split: line 1 is queued alone, then the batch
+        # of lines 3 and 4 is rolled back as well
+        with mock.patch.object(
+            PartnerMapper, "finalize", autospec=True, side_effect=finalize
+        ):
+            res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 6,
+                "errored": 2,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        report = self.recordset.get_report()
+        self.assertEqual(
+            sorted(x["line_nr"] for x in report[model]["created"]),
+            [1, 3, 5, 6, 7, 8],
+        )
+        created_ids = [x["odoo_record"] for x in report[model]["created"]]
+        self.assertEqual(len(self.env[model].browse(created_ids).exists()), 6)
+
+    @mute_logger("[importer]")
+    def test_importer_update_grouped(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_grouped_write: True
+        """
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        self.record.set_data(lines)
+        self.record.run_import()
+        self.recordset.set_report({}, reset=True)
+        for line in lines:
+            line["fullname"] = "Same name"
+        # same unique key twice: the last line wins
+        lines.append(dict(lines[0], fullname="Last name"))
+        self.record.set_data(lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 0,
+                "errored": 0,
+                "updated": 11,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        partners = self.env[model].search([("ref", "like", "id_%")])
+        self.assertEqual(len(partners), 10)
+        self.assertEqual(partners.filtered(lambda x: x.ref == "id_1").name, "Last name")
+        self.assertEqual(
+            set(partners.filtered(lambda x: x.ref != "id_1").mapped("name")),
+            {"Same name"},
+        )
+
+    @mute_logger("[importer]")
+    def test_importer_update_grouped_finalize_error(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_grouped_write: True
+        """
+        lines = self._fake_lines(3, keys=("id", "fullname"))
+        self.record.set_data(lines)
+        self.record.run_import()
+        self.recordset.set_report({}, reset=True)
+        for line in lines:
+            line["fullname"] = "Same name"
+        self.record.set_data(lines)
+
+        def post_write(handler, odoo_record, values, orig_values):
+            if odoo_record.ref == "id_2":
+                raise ValueError("Broken line")
+
+        handler_cls = self.comp_registry["importer.odoorecord.handler"]
+        with mock.patch.object(handler_cls, "odoo_post_write", new=post_write):
+            res = self.record.run_import()
+        model = "res.partner"
+        self.assertEqual(res[model]["updated"], 2)
+        self.assertEqual(res[model]["errored"], 1)
+        # the broken line is rolled back entirely
+        self.env[model].invalidate_cache()
+        partner = self.env[model].search([("ref", "=", "id_2")])
+        self.assertEqual(partner.name, "fullname_2")
+        partners = self.env[model].search([("ref", "in", ("id_1", "id_3"))])
+        self.assertEqual(set(partners.mapped("name")), {"Same name"})
+
+    @mute_logger("[importer]")
+    def test_importer_update_skip_unchanged(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    record_handler:
+      use_lookup_index: True
+      skip_fields_unchanged: True
+        """
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        self.record.set_data(lines)
+        self.record.run_import()
+        self.recordset.set_report({}, reset=True)
+        lines[0]["fullname"] = "Changed"
+        self.record.set_data(lines)
+        partner_model = type(self.env["res.partner"])
+        with mock.patch.object(
+            partner_model, "write", autospec=True, side_effect=partner_model.write
+        ) as mocked_write:
+            res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 0,
+                "errored": 0,
+                "updated": 10,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        # only the changed line is written
+        mocked_write.assert_called_once()
+        self.assertEqual(mocked_write.call_args[0][1], {"name": "Changed"})
+
+    @mute_logger("[importer]")
+    def test_importer_skip_unchanged_lines(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    importer:
+      skip_unchanged_lines: True
+        """
+        lines = self._fake_lines(10, keys=("id", "fullname"))
+        self.record.set_data(lines)
+        self.record.run_import()
+        self.recordset.set_report({}, reset=True)
+        # one line changed, one record deleted
+        lines[0]["fullname"] = "Changed"
+        self.env["res.partner"].search([("ref", "=", lines[1]["id"])]).unlink()
+        self.record.set_data(lines)
+        res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 1,
+                "errored": 0,
+                "updated": 1,
+                "skipped": 0,
+                "unchanged": 8,
+            }
+        }
+        self.assertEqual(res, expected)
+        self.recordset.set_report({}, reset=True)
+        res = self.record.run_import()
+        self.assertEqual(res[model]["unchanged"], 10)
+
+    def _run_import_logs(self, log_mode):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    tracking_handler:
+      log_mode: {}
+      log_sample_rate: 4
+        """.format(log_mode)
+        self.record.set_data(self._fake_lines(10, keys=("id", "fullname")))
+        with self.assertLogs("[importer]", level="INFO") as logs:
+            self.record.run_import()
+        # only records emitted by the tracker
+        return [x for x in logs.records if hasattr(x, "import_event")]
+
+    def test_importer_log_mode_chunk(self):
+        records = self._run_import_logs("chunk")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].import_event, "chunk_finished")
+        self.assertEqual(records[0].import_model, "res.partner")
+        self.assertEqual(records[0].import_created, 10)
+        self.assertIn("CHUNK FINISHED [created: 10]", records[0].getMessage())
+
+    def test_importer_log_mode_invalid(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    tracking_handler:
+      log_mode: lines
+        """
+        self.record.set_data(self._fake_lines(3, keys=("id", "fullname")))
+        # the whole import fails, not each line
+        with self.assertRaisesRegex(ValueError, "log_mode"):
+            self.record.run_import()
+        self.assertFalse(self.env["res.partner"].search([("ref", "like", "id_%")]))
+
+    def test_importer_log_mode_sample(self):
+        records = self._run_import_logs("sample")
+        created = [x for x in records if x.import_event == "created"]
+        # 1st, 5th and 9th line
+        self.assertEqual([x.import_line_nr for x in created], [1, 5, 9])
+        self.assertTrue(all(x.import_record_id for x in created))
+        self.assertEqual(records[-1].import_event, "chunk_finished")
+
+    @mute_logger("[importer]")
+    def test_importer_savepoint_batch(self):
+        self.import_type.options = """
+- model: res.partner
+  importer: fake.partner.importer
+  options:
+    importer:
+      savepoint_batch_size: 4
+        """
+        self.record.set_data(self._fake_lines(10, keys=("id", "fullname")))
+        partner_model = type(self.env["res.partner"])
+        orig_create = partner_model.create
+
+        def create(records, vals):
+            if vals.get("ref") == "id_6":
+                raise ValueError("Broken line")
+            return orig_create(records, vals)
+
+        cr = self.env.cr
+        with mock.patch.object(
+            partner_model, "create", autospec=True, side_effect=create
+        ), mock.patch.object(cr, "savepoint", wraps=cr.savepoint) as savepoint:
+            res = self.record.run_import()
+        model = "res.partner"
+        expected = {
+            model: {
+                "created": 9,
+                "errored": 1,
+                "updated": 0,
+                "skipped": 0,
+                "unchanged": 0,
+            }
+        }
+        self.assertEqual(res, expected)
+        report = self.recordset.get_report()
+        self.assertEqual(report[model]["errored"][0]["line_nr"], 6)
+        self.assertEqual(report[model]["errored"][0]["message"], "Broken line")
+        created_ids = [x["odoo_record"] for x in report[model]["created"]]
+        self.assertEqual(
+            sorted(x["line_nr"] for x in report[model]["created"]),
+            [1, 2, 3, 4, 5, 7, 8, 9, 10],
+        )
+        partners = self.env[model].browse(created_ids).exists()
+        self.assertEqual(len(partners), 9)
+        self.assertNotIn("id_6", partners.mapped("ref"))
+        # 3 batches, the 2nd one split up to isolate the broken line,
+        # instead of 2 savepoints per line
+        self.assertLess(savepoint.call_count, 2 * 10)
@@ -2,10 +2,19 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import logging
+import time
+
+import mock
+
 from odoo.tools import mute_logger
 
+from odoo.addons.queue_job.exception import RetryableJobError
+
 from .common import TestImporterBase
 
+_logger = logging.getLogger(__name__)
+
 
 class TestRecordImporter(TestImporterBase):
     @classmethod
@@ -19,8 +28,13 @@ class TestRecordImporter(TestImporterBase):
         return [PartnerRecordImporter, PartnerMapper]
 
     def _get_importer(self):
+        config = self.import_type._make_importer_info(
+            {"model": "res.partner", "importer": "fake.partner.importer"}
+        )
         with self.backend.work_on(
-            self.record._name, components_registry=self.comp_registry
+            self.record._name,
+            components_registry=self.comp_registry,
+            options=config.options,
         ) as work:
             return work.component(usage="record.importer", model_name="res.partner")
 
@@ -34,6 +48,89 @@ class TestRecordImporter(TestImporterBase):
         importer = self._get_importer()
         required = importer.required_keys()
         self.assertDictEqual(required, {"fullname": ("name",), "id": ("ref",)})
+        # mapper's declaration is left untouched
+        self.assertDictEqual(
+            importer.mapper.required, {"fullname": "name", "id": "ref"}
+        )
+
+    @mute_logger("[importer]")
+    def test_importer_plan(self):
+        importer = self._get_importer()
+        importer._init_importer(self.recordset)
+        self.assertEqual(
+            importer._required_plan, (("fullname", ("name",)), ("id", ("ref",)))
+        )
+        # no translatable key on the mapper
+        self.assertEqual(importer._translatable_plan, ())
+
+    @mute_logger("[importer]")
+    def test_importer_unchanged_lines_translations(self):
+        importer = self._get_importer()
+        importer._init_importer(self.recordset)
+        importer._translatable_plan = (("fr_FR", "name", "name:fr_FR"),)
+        partner = self.env["res.partner"].create({"name": "Foo", "ref": "id_1"})
+        line = {"_line_nr": 1, "id": "id_1", "fullname": "Foo", "name:fr_FR": "Fou"}
+        values = {"ref": "id_1", "name": "Foo"}
+        self.env["import.line.hash"]._set_hashes(
+            self.import_type,
+            "res.partner",
+            [("id_1", importer._hash_values(values, line), partner.id)],
+        )
+        res = list(importer._filter_unchanged_lines([(line, values)]))
+        self.assertEqual(res, [])
+        # only the translation changed: the line must be imported
+        line = dict(line, **{"name:fr_FR": "Fu"})
+        res = list(importer._filter_unchanged_lines([(line, values)]))
+        self.assertEqual(res, [(line, values)])
+        # w/o translatable keys only mapped values are hashed
+        importer._translatable_plan = ()
+        self.assertEqual(
+            importer._hash_values(values, line), importer._hash_values(values)
+        )
+
+    def test_lookup_index_typed_key(self):
+        importer = self._get_importer()
+        importer._init_importer(self.recordset)
+        handler = importer.record_handler
+        # integer unique key, mapped as string
+        handler.unique_key = "color"
+        partner = self.env["res.partner"].create({"name": "Foo", "color": 987654})
+        handler.prefetch([{"color": "987654"}, {"color": "987655"}])
+        self.assertEqual(handler._lookup_index, {"987654": partner.id, "987655": None})
+        self.assertEqual(handler.odoo_find({"color": "987654"}, {}), partner)
+
+    def test_current_values_not_comparable(self):
+        importer = self._get_importer()
+        importer._init_importer(self.recordset)
+        handler = importer.record_handler
+        partner = self.env["res.partner"].create({"name": "Foo"})
+        partner_model = type(partner)
+        with mock.patch.object(partner_model, "read", autospec=True) as mocked_read:
+            res = handler._get_current_values(partner, ["image_1920", "not_a_field"])
+        self.assertEqual(res, {})
+        mocked_read.assert_not_called()
+
+    def _time_mapping(self, mapper, lines):
+        start = time.perf_counter()
+        res = [mapper.map_record(line).values(for_create=True) for line in lines]
+        return res, (time.perf_counter() - start) / len(lines)
+
+    def test_mapper_plan(self):
+        mapper = self._get_importer().mapper
+        lines = self._fake_lines(1000, keys=("id", "fullname"))
+        mapper._use_mapping_plan = False
+        expected, before = self._time_mapping(mapper, lines)
+        mapper._use_mapping_plan = True
+        res, after = self._time_mapping(mapper, lines)
+        self.assertEqual(res, expected)
+        self.assertEqual(
+            res[0], {"ref": "id_1", "name": "fullname_1", "is_company": False}
+        )
+        _logger.info(
+            "Mapping cost per line: %.1fus w/o plan, %.1fus w/ plan",
+            before * 1e6,
+            after * 1e6,
+        )
 
     @mute_logger("[importer]")
     def test_importer_check_missing_none(self):
@@ -86,3 +183,131 @@ class TestRecordImporter(TestImporterBase):
         self.assertDictEqual(
             missing, {"message": "MISSING REQUIRED DESTINATION KEY=ref"}
         )
+
+    def test_backend_to_rel_cache(self):
+        from ..utils.mapper_utils import backend_to_rel
+
+        mapper = self._get_importer().mapper
+        modifier = backend_to_rel("country", search_field="code")
+        lines = [
+            {"_line_nr": 1, "country": "IT"},
+            {"_line_nr": 2, "country": "FR"},
+            {"_line_nr": 3, "country": "IT"},
+            {"_line_nr": 4, "country": "XX"},
+        ]
+        italy = self.env.ref("base.it")
+        france = self.env.ref("base.fr")
+        self.assertEqual(modifier(mapper, lines[0], "country_id"), italy.id)
+        self.assertEqual(len(mapper._lookup_cache), 1)
+        self.assertEqual(modifier(mapper, lines[2], "country_id"), italy.id)
+        self.assertEqual(len(mapper._lookup_cache), 1)
+        # prefetch resolves all the values at once, missing ones included
+        mapper._lookup_cache.clear()
+        modifier.prefetch(mapper, lines, "country_id")
+        self.assertEqual(len(mapper._lookup_cache), 3)
+        self.assertEqual(modifier(mapper, lines[1], "country_id"), france.id)
+        self.assertIsNone(modifier(mapper, lines[3], "country_id"))
+        self.assertEqual(len(mapper._lookup_cache), 3)
+
+    def test_backend_to_rel_create_missing(self):
+        from ..utils.mapper_utils import backend_to_rel
+
+        mapper = self._get_importer().mapper
+        modifier = backend_to_rel("title", create_missing=True)
+        lines = [
+            {"_line_nr": 1, "title": "Title A"},
+            {"_line_nr": 2, "title": "Title B"},
+            {"_line_nr": 3, "title": "Title A"},
+        ]
+        title_model = self.env["res.partner.title"]
+        domain = [("name", "in", ("Title A", "Title B"))]
+        self.assertFalse(title_model.search(domain))
+        # missing records are created all together
+        modifier.prefetch(mapper, lines, "title")
+        titles = title_model.search(domain)
+        self.assertEqual(len(titles), 2)
+        values = [modifier(mapper, line, "title") for line in lines]
+        self.assertEqual(values[0], values[2])
+        self.assertEqual(set(values), set(titles.ids))
+        self.assertEqual(title_model.search_count(domain), 2)
+
+    def test_backend_to_rel_get_or_create(self):
+        from ..utils.mapper_utils import _create_missing_records
+
+        mapper = self._get_importer().mapper
+        title_model = self.env["res.partner.title"]
+        # created by another job in the meantime
+        title_a = title_model.create({"name": "Title A"})
+        missing = [
+            ("Title A", {"title": "Title A"}),
+            ("Title B", {"title": "Title B"}),
+        ]
+        res = _create_missing_records(mapper, title_model, missing, "title", "name")
+        self.assertEqual(res["Title A"], [title_a.id])
+        title_b = title_model.browse(res["Title B"])
+        self.assertEqual(title_b.name, "Title B")
+        self.assertEqual(title_model.search_count([("name", "=", "Title A")]), 1)
+
+    def test_backend_to_rel_get_or_create_job(self):
+        from ..utils.mapper_utils import backend_to_rel
+
+        self.backend = self.backend.with_context(job_uuid="test-uuid")
+        mapper = self._get_importer().mapper
+        title_model = self.env["res.partner.title"]
+        title_a = title_model.create({"name": "Title A"})
+        modifier = backend_to_rel("title", create_missing=True)
+        lines = [
+            {"_line_nr": 1, "title": "Title A"},
+            {"_line_nr": 2, "title": "Title B"},
+        ]
+        modifier.prefetch(mapper, lines, "title")
+        # records created by the job are usable right away
+        title_b = title_model.search([("name", "=", "Title B")])
+        self.assertEqual(len(title_b), 1)
+        cache = mapper._lookup_cache
+        self.assertEqual(modifier(mapper, lines[0], "title"), title_a.id)
+        self.assertEqual(modifier(mapper, lines[1], "title"), title_b.id)
+        self.assertEqual(cache.hits, 2)
+        # another job committed the same value after this one started
+        line = {"_line_nr": 3, "title": "Title C"}
+        with mock.patch(
+            "odoo.addons.connector_importer.utils.mapper_utils."
+            "_search_committed_values",
+            return_value={"Title C"},
+        ):
+            with self.assertRaises(RetryableJobError):
+                modifier.prefetch(mapper, [line], "title")
+        self.assertFalse(title_model.search([("name", "=", "Title C")]))
+
+    def test_lookup_cache(self):
+        from ..utils.mapper_utils import LookupCache
+
+        cache = LookupCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        # least recently used key is dropped
+        cache.set("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_xmlid_to_rel_cache(self):
+        from ..utils.mapper_utils import xmlid_to_rel
+
+        mapper = self._get_importer().mapper
+        modifier = xmlid_to_rel("users")
+        line = {"_line_nr": 1, "users": ["base.user_root", "base.user_admin"]}
+        users = self.env.ref("base.user_root") + self.env.ref("base.user_admin")
+        # one command for all the records
+        self.assertEqual(modifier(mapper, line, "user_ids"), [(6, 0, users.ids)])
+        cache = mapper._lookup_cache
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        modifier(mapper, line, "user_ids")
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        # prefetch resolves all xmlids w/ one query
+        cache.clear()
+        lines = [line, {"_line_nr": 2, "users": ["base.missing_xmlid"]}]
+        modifier.prefetch(mapper, lines, "user_ids")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(modifier(mapper, lines[1], "user_ids"), [])
@@ -5,6 +5,8 @@
 
 import odoo.tests.common as common
 
+from ..components.tracker import CompactChunkReport
+
 
 class TestRecordset(common.SavepointCase):
     @classmethod
@@ -72,6 +74,80 @@ class TestRecordset(common.SavepointCase):
         self.recordset.set_report(val, reset=True)
         self.assertDictEqual(self.recordset.get_report(), val)
 
+    def test_chunk_reports(self):
+        self.recordset.set_report(
+            {"_last_start": "2018-01-20", "res.partner": {"created": [1]}}
+        )
+        self.recordset.add_chunk_report(
+            "res.partner", {"created": [2, 3], "errored": [4]}
+        )
+        self.recordset.add_chunk_report("res.partner", {"created": [5], "errored": []})
+        self.recordset.add_chunk_report("res.users", {"updated": [6]})
+        chunk_model = self.env["import.report.chunk"]
+        domain = [("recordset_id", "=", self.recordset.id)]
+        self.assertEqual(chunk_model.search_count(domain), 3)
+        expected = {
+            "_last_start": "2018-01-20",
+            "res.partner": {"created": [1, 2, 3, 5], "errored": [4]},
+            "res.users": {"updated": [6]},
+        }
+        self.assertDictEqual(self.recordset.get_report(), expected)
+        # stored values are left untouched
+        self.assertDictEqual(
+            self.recordset.report_data,
+            {"_last_start": "2018-01-20", "res.partner": {"created": [1]}},
+        )
+        # reset drops chunk reports too
+        self.recordset.set_report({}, reset=True)
+        self.assertEqual(chunk_model.search_count(domain), 0)
+        self.assertDictEqual(self.recordset.get_report(), {})
+
+    def test_chunk_reports_compact(self):
+        report = CompactChunkReport()
+        item = {"line_nr": 1, "message": "", "model": "res.partner"}
+        report.track_created(dict(item, odoo_record=10))
+        report.track_created(dict(item, line_nr=2, odoo_record=11))
+        report.track_unchanged(dict(item, line_nr=3, odoo_record=None))
+        report.track_error(dict(item, line_nr=4, message="Boom"))
+        self.assertEqual(
+            report.counters(),
+            {"created": 2, "updated": 0, "errored": 1, "skipped": 0, "unchanged": 1},
+        )
+        self.recordset.add_chunk_report("res.partner", report.to_report())
+        chunk = self.env["import.report.chunk"].search(
+            [("recordset_id", "=", self.recordset.id)]
+        )
+        self.assertEqual(
+            chunk.report_data["created"], {"line_nr": [1, 2], "odoo_record": [10, 11]}
+        )
+        self.assertEqual((chunk.created, chunk.unchanged, chunk.errored), (2, 1, 1))
+        report = self.recordset.get_report()["res.partner"]
+        self.assertEqual(
+            report["created"],
+            [
+                dict(item, line_nr=1, odoo_record=10),
+                dict(item, line_nr=2, odoo_record=11),
+            ],
+        )
+        self.assertEqual(report["unchanged"][0]["odoo_record"], None)
+        self.assertEqual(report["errored"][0]["message"], "Boom")
+
+    def test_report_counters(self):
+        self.recordset.set_report({"res.partner": {"created": [1], "errored": [2]}})
+        self.recordset.add_chunk_report(
+            "res.partner", {"created": [3, 4], "errored": [], "skipped": [5]}
+        )
+        self.recordset.add_chunk_report(
+            "res.partner", {"created": [6]}, counters={"created": 1, "updated": 3}
+        )
+        self.recordset.add_chunk_report("res.users", {"updated": [7]})
+        counters = self.recordset.get_report_counters()
+        self.assertDictEqual(
+            counters["res.partner"],
+            {"created": 4, "updated": 3, "errored": 1, "skipped": 1, "unchanged": 0},
+        )
+        self.assertEqual(counters["res.users"]["updated"], 1)
+
     def test_get_report_html_data(self):
         val = {
             "_last_start": "2018-01-20",
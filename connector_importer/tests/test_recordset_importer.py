@@ -53,3 +53,67 @@ class TestRecordsetImporter(TestImporterBase):
         # we expect 5 records w/ 20 lines each
         records = self.recordset.get_records()
         self.assertEqual(len(records), 5)
+
+    @mute_logger("[importer]")
+    def test_recordset_importer_jobs(self):
+        self.backend.debug_mode = False
+        lines = self._fake_lines(30, keys=("id", "fullname"))
+        self._patch_get_source(lines, chunk_size=10)
+        with self.backend.work_on(
+            "import.recordset", components_registry=self.comp_registry
+        ) as work:
+            importer = work.component(usage="recordset.importer")
+            with mock.patch.dict("os.environ", {"IMPORTER_DEBUG_MODE": ""}):
+                importer.run(self.recordset)
+        records = self.recordset.get_records()
+        self.assertEqual(len(records), 3)
+        self.assertEqual(
+            [rec.get_data()[0]["id"] for rec in records], ["id_1", "id_11", "id_21"]
+        )
+        # each record is linked to its own job
+        jobs = records.mapped("job_id")
+        self.assertEqual(len(jobs), 3)
+        for rec in records:
+            self.assertEqual(rec.job_id.model_name, "import.record")
+            self.assertEqual(rec.job_id.record_ids, [rec.id])
+            self.assertEqual(rec.job_id.method_name, "import_record")
+
+    @mute_logger("[importer]")
+    @mock.patch("%s.run_import" % RECORD_MODEL)
+    def test_recordset_importer_split_resume(self, mocked_run_import):
+        self.backend.debug_mode = False
+        self.import_type.split_batch_size = 2
+        lines = self._fake_lines(50, keys=("id", "fullname"))
+        self._patch_get_source(lines, chunk_size=10)
+
+        def run(job_uuid):
+            with self.backend.with_context(job_uuid=job_uuid).work_on(
+                "import.recordset", components_registry=self.comp_registry
+            ) as work:
+                importer = work.component(usage="recordset.importer")
+                with mock.patch.dict("os.environ", {"IMPORTER_DEBUG_MODE": ""}):
+                    with mock.patch.object(type(importer), "_commit_split_batch"):
+                        importer.run(self.recordset)
+
+        run("job-1")
+        records = self.recordset.get_records()
+        self.assertEqual(len(records), 5)
+        # the job got killed after the 1st batch was committed
+        records[2:].unlink()
+        committed = records[:2].exists()
+        mocked_run_import.reset_mock()
+        # retry: committed chunks are not split again
+        run("job-1")
+        records = self.recordset.get_records()
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[:2], committed)
+        self.assertEqual(
+            [rec.get_data()[0]["id"] for rec in records],
+            ["id_1", "id_11", "id_21", "id_31", "id_41"],
+        )
+        self.assertEqual(mocked_run_import.call_count, 2)
+        # a new job starts over
+        run("job-2")
+        records = self.recordset.get_records()
+        self.assertEqual(len(records), 5)
+        self.assertFalse(records & committed)
@@ -4,6 +4,7 @@
 
 import base64
 
+import mock
 from odoo_test_helper import FakeModelLoader
 
 from odoo.tools import mute_logger
@@ -55,6 +56,9 @@ class TestSourceCSV(BaseTestCase):
         "csv_delimiter",
         "csv_quotechar",
         "csv_encoding",
+        "csv_read_mode",
+        "csv_checksum",
+        "csv_line_count",
     ]
 
     @mute_logger("[importer]")
@@ -64,6 +68,26 @@ class TestSourceCSV(BaseTestCase):
         self.assertItemsEqual(source._config_summary_fields, self.extra_fields)
         self.assertEqual(source.csv_delimiter, ",")
         self.assertEqual(source.csv_quotechar, '"')
+        # ascii is a subset of utf-8, the file might contain more
+        self.assertEqual(source.csv_encoding, "utf-8")
+        self.assertEqual(source.csv_line_count, 6)
+        self.assertEqual(len(source.csv_checksum), 64)
+        self.assertEqual(source.csv_metadata["header"], ["id", "fullname"])
+
+    @mute_logger("[importer]")
+    def test_source_metadata_update(self):
+        source = self.source
+        source.csv_encoding = "latin-1"
+        content = "id,fullname\n1,Marty McFly\n"
+        source.csv_file = base64.encodestring(content.encode("utf-8"))
+        source._onchange_csv_file()
+        # the encoding set by the user is kept
+        self.assertEqual(source.csv_encoding, "latin-1")
+        self.assertEqual(source.csv_line_count, 2)
+        source.csv_file = False
+        self.assertFalse(source.csv_metadata)
+        self.assertFalse(source.csv_checksum)
+        self.assertFalse(source.csv_line_count)
 
     @mute_logger("[importer]")
     def test_source_get_lines(self):
@@ -87,6 +111,157 @@ class TestSourceCSV(BaseTestCase):
             lines[4], {"id": "5", "fullname": "George McFly", "_line_nr": 6}
         )
 
+    @mute_logger("[importer]")
+    def test_source_get_lines_stream(self):
+        source = self.source
+        source.csv_read_mode = "stream"
+        lines = list(source._get_lines())
+        self.assertEqual(len(lines), 5)
+        self.assertDictEqual(
+            lines[0], {"id": "1", "fullname": "Marty McFly", "_line_nr": 2}
+        )
+        self.assertDictEqual(
+            lines[4], {"id": "5", "fullname": "George McFly", "_line_nr": 6}
+        )
+
+    @mute_logger("[importer]")
+    def test_source_encoding_sample(self):
+        source = self.source
+        source._csv_encoding_sample_size = 32
+        content = "id,fullname\n" + "1,Marty McFly\n" * 10 + "2,Lorraine Baïnes\n"
+        source.csv_file = base64.encodestring(content.encode("utf-8"))
+        source.csv_encoding = False
+        source._onchange_csv_file()
+        self.assertEqual(source.csv_encoding, "utf-8")
+        lines = list(source._get_lines())
+        self.assertEqual(lines[-1]["fullname"], "Lorraine Baïnes")
+
+    @mute_logger("[importer]")
+    def test_source_encoding_sample_not_utf8(self):
+        source = self.source
+        source._csv_encoding_sample_size = 32
+        # the sample and the probes are pure ascii
+        content = "id,fullname\n" + "1,Marty McFly\n" * 2000 + "2,Lorraine Baïnes\n"
+        source.csv_file = base64.encodestring(content.encode("latin-1"))
+        source.csv_encoding = False
+        source._onchange_csv_file()
+        self.assertNotEqual(source.csv_encoding, "utf-8")
+        for read_mode in ("memory", "stream", "mmap"):
+            source.csv_read_mode = read_mode
+            lines = list(source._get_lines())
+            self.assertEqual(lines[-1]["fullname"], "Lorraine Baïnes", read_mode)
+
+    @mute_logger("[importer]")
+    def test_source_get_lines_mmap(self):
+        source = self.source
+        source.csv_read_mode = "mmap"
+        lines = list(source._get_lines())
+        self.assertEqual(len(lines), 5)
+        self.assertDictEqual(
+            lines[0], {"id": "1", "fullname": "Marty McFly", "_line_nr": 2}
+        )
+        self.assertDictEqual(
+            lines[4], {"id": "5", "fullname": "George McFly", "_line_nr": 6}
+        )
+
+    @mute_logger("[importer]")
+    def test_source_get_lines_mmap_quotes(self):
+        source = self.source
+        source.csv_read_mode = "mmap"
+        source.chunk_size = 1
+        content = 'id,name\n1,24" monitor\n2,"multi\nline ""quoted"""\n3,8" tablet\n'
+        source.csv_file = base64.encodestring(content.encode("utf-8"))
+        source._onchange_csv_file()
+        refs = list(source.get_chunk_refs())
+        self.assertEqual(
+            [(x["line_from"], x["line_to"]) for x in refs], [(2, 2), (3, 4), (5, 5)]
+        )
+        lines = [line for ref in refs for line in source.get_lines_by_ref(ref)]
+        self.assertEqual(
+            [line["name"] for line in lines],
+            ['24" monitor', 'multi\nline "quoted"', '8" tablet'],
+        )
+        # encoding and header are detected once per reader
+        reader = source._get_mmap_reader()
+        reader.encoding = None
+        with mock.patch.object(
+            type(reader), "_get_encoding", return_value="utf-8"
+        ) as mocked:
+            for ref in refs:
+                list(reader.read_range(ref["offset_from"], ref["offset_to"]))
+        self.assertEqual(mocked.call_count, 1)
+
+    @mute_logger("[importer]")
+    def test_source_get_lines_quotechar(self):
+        source = self.source
+        content = "id,name\n1,'Brown, Emmet'\n2,'It''s Marty'\n"
+        source.csv_file = base64.encodestring(content.encode("utf-8"))
+        source._onchange_csv_file()
+        source.csv_quotechar = "'"
+        for read_mode in ("memory", "stream", "mmap"):
+            source.csv_read_mode = read_mode
+            lines = list(source._get_lines())
+            self.assertEqual(
+                [line["name"] for line in lines],
+                ["Brown, Emmet", "It's Marty"],
+                read_mode,
+            )
+
+    @mute_logger("[importer]")
+    def test_source_get_chunk_refs_header_only(self):
+        source = self.source
+        source.csv_read_mode = "mmap"
+        source.chunk_size = 0
+        source.csv_file = base64.encodestring(b"id,fullname\n")
+        source._onchange_csv_file()
+        self.assertEqual(list(source.get_chunk_refs()), [])
+        self.assertEqual(list(source._get_lines()), [])
+
+    @mute_logger("[importer]")
+    def test_source_get_lines_by_ref(self):
+        source = self.source
+        source.csv_read_mode = "mmap"
+        source.chunk_size = 2
+        refs = list(source.get_chunk_refs())
+        self.assertEqual(len(refs), 3)
+        self.assertEqual(
+            [(x["line_from"], x["line_to"]) for x in refs], [(2, 3), (4, 5), (6, 6)]
+        )
+        lines = list(source.get_lines_by_ref(refs[1]))
+        self.assertEqual(
+            lines,
+            [
+                {"id": "3", "fullname": "Emmet Brown", "_line_nr": 4},
+                {"id": "4", "fullname": "Clara Clayton", "_line_nr": 5},
+            ],
+        )
+
+    @mute_logger("[importer]")
+    def test_record_data_by_ref(self):
+        source = self.source
+        source.csv_read_mode = "mmap"
+        source.chunk_size = 2
+        backend = self.env["import.backend"].create({"name": "Foo", "version": "1.0"})
+        import_type = self.env["import.type"].create(
+            {"name": "Fake", "key": "fake", "options": "- model: res.partner"}
+        )
+        recordset = self.env["import.recordset"].create(
+            {
+                "backend_id": backend.id,
+                "import_type_id": import_type.id,
+                "source_model": source._name,
+                "source_id": source.id,
+            }
+        )
+        record = self.env["import.record"].create({"recordset_id": recordset.id})
+        ref = list(source.get_chunk_refs())[-1]
+        record.set_data_ref(source, ref)
+        self.assertFalse(record.jsondata_file)
+        self.assertEqual(record.get_data_source(), source)
+        self.assertEqual(
+            record.get_data(), [{"id": "5", "fullname": "George McFly", "_line_nr": 6}]
+        )
+
     def test_source_summary_data(self):
         source = self.source
         data = source._config_summary_data()
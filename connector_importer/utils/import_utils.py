@@ -2,9 +2,16 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import codecs
 import csv
+import hashlib
 import io
+import mmap
+import os
+import random
 import time
+from array import array
+from contextlib import contextmanager
 
 from ..log import logger
 
@@ -17,18 +24,51 @@ except ImportError:
     _logger.debug("`chardet` lib is missing")
 
 
-def get_encoding(data):
+# default settings for encoding detection:
+# the 1st `ENCODING_SAMPLE_SIZE` bytes are analyzed
+# plus `ENCODING_PROBES` random portions of `ENCODING_PROBE_SIZE` bytes
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_PROBES = 4
+ENCODING_PROBE_SIZE = 4 * 1024
+
+
+def _encoding_samples(data, sample_size, probes, probe_size):
+    """Yield portions of data to analyze to guess its encoding."""
+    if not sample_size or len(data) <= sample_size + probes * probe_size:
+        yield data
+        return
+    yield data[:sample_size]
+    rnd = random.Random(len(data))
+    for offset in sorted(rnd.sample(range(sample_size, len(data)), probes)):
+        # start on a new line to not cut multi-byte chars
+        start = data.find(b"\n", offset) + 1
+        if start:
+            yield data[start : start + probe_size]
+
+
+def get_encoding(
+    data,
+    sample_size=ENCODING_SAMPLE_SIZE,
+    probes=ENCODING_PROBES,
+    probe_size=ENCODING_PROBE_SIZE,
+):
     """Try to get encoding incrementally.
 
     See http://chardet.readthedocs.org/en/latest/usage.html#example-detecting-encoding-incrementally  # noqa
+
+    Only a sample of data is analyzed: the first `sample_size` bytes
+    plus `probes` random portions of `probe_size` bytes.
+    Pass `sample_size=None` to analyze the whole data.
     """
     start = time.time()
     msg = "detecting file encoding..."
     logger.info(msg)
-    file_like = io.BytesIO(data)
     detector = UniversalDetector()
-    for _i, line in enumerate(file_like):
-        detector.feed(line)
+    for sample in _encoding_samples(data, sample_size, probes, probe_size):
+        for _i, line in enumerate(io.BytesIO(sample)):
+            detector.feed(line)
+            if detector.done:
+                break
         if detector.done:
             break
     detector.close()
@@ -38,6 +78,44 @@ def get_encoding(data):
     return detector.result
 
 
+def _is_utf8(fileobj, block_size=1024 * 1024):
+    """Tell if the whole content of a binary file object is valid utf-8."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for block in iter(lambda: fileobj.read(block_size), b""):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    finally:
+        fileobj.seek(0)
+    return True
+
+
+def check_sampled_encoding(encoding, fileobj):
+    """Validate an encoding guessed on a sample of a binary file object.
+
+    The sample might be pure ascii while the rest of the file is not:
+    in this case, the whole file is checked and analyzed if needed.
+    """
+    if encoding and encoding.lower() != "ascii":
+        return encoding
+    if _is_utf8(fileobj):
+        return "utf-8"
+    detector = UniversalDetector()
+    for line in iter(fileobj.readline, b""):
+        detector.feed(line)
+        if detector.done:
+            break
+    detector.close()
+    fileobj.seek(0)
+    encoding = detector.result["encoding"]
+    if not encoding or encoding.lower() == "ascii":
+        # any byte can be decoded as latin-1
+        encoding = "latin-1"
+    return encoding
+
+
 def csv_content_to_file(data, encoding=None):
     """Odoo binary fields spit out b64 data."""
     # guess encoding via chardet (LOVE IT! :))
@@ -62,18 +140,54 @@ def csv_content_to_file(data, encoding=None):
     return data_str
 
 
-def guess_csv_metadata(filecontent):
+def _first_line(filecontent):
+    end = filecontent.find(b"\n")
+    return filecontent[:end] if end != -1 else filecontent
+
+
+def guess_csv_metadata(filecontent, encoding=None):
     # we don't care about acuracy but we don't to get an unicode error
     # when converting to str
-    encoding = get_encoding(filecontent)
-    with io.StringIO(str(filecontent, encoding["encoding"])) as ff:
-        try:
-            dialect = csv.Sniffer().sniff(ff.readline(), "\t,;")
-            ff.seek(0)
-            meta = {"delimiter": dialect.delimiter, "quotechar": dialect.quotechar}
-        except BaseException:
-            meta = {}
-        return meta
+    encoding = encoding or get_encoding(filecontent)["encoding"]
+    # only the 1st line is needed to sniff the dialect
+    first_line = str(_first_line(filecontent), encoding or "utf-8", "replace")
+    try:
+        dialect = csv.Sniffer().sniff(first_line, "\t,;")
+        meta = {"delimiter": dialect.delimiter, "quotechar": dialect.quotechar}
+    except BaseException:
+        meta = {}
+    return meta
+
+
+def get_csv_metadata(filecontent, encoding=None):
+    """Collect CSV file metadata.
+
+    :param filecontent: raw file content
+    :param encoding: file encoding, guessed if not provided
+    :return: dictionary containing `checksum` (SHA-256), `size` (bytes),
+        `line_count`, `encoding`, `delimiter`, `quotechar`, `header`.
+    """
+    encoding = encoding or get_encoding(filecontent)["encoding"]
+    line_count = filecontent.count(b"\n")
+    if filecontent and not filecontent.endswith(b"\n"):
+        line_count += 1
+    meta = {
+        "checksum": hashlib.sha256(filecontent).hexdigest(),
+        "size": len(filecontent),
+        "line_count": line_count,
+        "encoding": encoding,
+        "delimiter": None,
+        "quotechar": None,
+        "header": [],
+    }
+    meta.update(guess_csv_metadata(filecontent, encoding=encoding))
+    if meta["delimiter"]:
+        first_line = str(_first_line(filecontent), encoding or "utf-8", "replace")
+        reader = csv.reader(
+            [first_line], delimiter=meta["delimiter"], quotechar=meta["quotechar"]
+        )
+        meta["header"] = [x.strip() for x in next(reader, [])]
+    return meta
 
 
 def read_path(path):
@@ -116,6 +230,260 @@ class CSVReader(object):
             yield line
 
 
+class CSVStreamReader(CSVReader):
+    """CSV reader consuming its source incrementally.
+
+    Contrary to `CSVReader` the file is never loaded in memory as a whole:
+    bytes are decoded on the fly and `csv.DictReader` is fed line by line.
+
+    Data can be provided via `filepath`, via a binary file-like object
+    (`fileobj`) or as raw bytes (`filedata`).
+    """
+
+    # bytes to read to guess the encoding when not provided
+    encoding_sample_size = 64 * 1024
+
+    def __init__(
+        self,
+        filepath=None,
+        filedata=None,
+        delimiter="|",
+        quotechar='"',
+        encoding=None,
+        fieldnames=None,
+        fileobj=None,
+    ):
+        assert (
+            filedata or filepath or fileobj
+        ), "Provide a file path, a file object or some file data!"
+        if filedata:
+            fileobj = io.BytesIO(filedata)
+        self.filepath = filepath
+        self.fileobj = fileobj
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.encoding = encoding
+        self.fieldnames = fieldnames
+
+    @contextmanager
+    def _open(self):
+        if self.filepath:
+            with open(self.filepath, "rb") as fileobj:
+                yield fileobj
+        else:
+            self.fileobj.seek(0)
+            yield self.fileobj
+
+    def _get_encoding(self, fileobj):
+        if self.encoding:
+            return self.encoding
+        sample = fileobj.read(self.encoding_sample_size)
+        fileobj.seek(0)
+        encoding = get_encoding(sample)["encoding"]
+        return check_sampled_encoding(encoding, fileobj)
+
+    def read_lines(self):
+        """Yields lines and add info to them (like line nr)."""
+        with self._open() as fileobj:
+            textfile = io.TextIOWrapper(
+                fileobj, encoding=self._get_encoding(fileobj), newline=""
+            )
+            try:
+                reader = csv.DictReader(
+                    textfile,
+                    delimiter=str(self.delimiter),
+                    quotechar=str(self.quotechar),
+                    fieldnames=self.fieldnames,
+                )
+                for line in reader:
+                    line["_line_nr"] = reader.line_num
+                    yield line
+            finally:
+                # do not let the wrapper close the file object
+                textfile.detach()
+
+
+class CSVMmapReader(CSVStreamReader):
+    """CSV reader backed by a memory-mapped file.
+
+    Records boundaries are indexed once (new lines inside quoted values
+    are taken into account), then any range of records can be decoded
+    straight from the mapped file without loading the rest of it.
+
+    Only ASCII compatible encodings (utf-8, latin-1, cp1252...)
+    and `\\n` or `\\r\\n` line endings are supported.
+    """
+
+    def __init__(
+        self,
+        filepath=None,
+        filedata=None,
+        delimiter="|",
+        quotechar='"',
+        encoding=None,
+        fieldnames=None,
+        fileobj=None,
+    ):
+        assert filepath, "Provide a file path!"
+        super().__init__(
+            filepath=filepath,
+            delimiter=delimiter,
+            quotechar=quotechar,
+            encoding=encoding,
+            fieldnames=fieldnames,
+        )
+        # end offset and line number of each record, header included
+        self.ends = None
+        self.line_nrs = None
+        # detected once, then reused by every `read_range` call
+        self._read_encoding = None
+        self._read_fieldnames = None
+
+    @contextmanager
+    def _mmap(self):
+        with open(self.filepath, "rb") as fileobj:
+            with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    def _scan_quotes(self, line, in_quotes):
+        """Return whether `line` ends inside a quoted value.
+
+        As for csv readers, a quote char only opens a quoted value
+        when it starts a field: elsewhere it is taken literally.
+        """
+        quotechar = str(self.quotechar).encode("ascii")
+        delimiter = str(self.delimiter).encode("ascii")
+        if not in_quotes and quotechar not in line:
+            return False
+        pos = 0
+        while True:
+            if in_quotes:
+                pos = line.find(quotechar, pos)
+                if pos == -1:
+                    return True
+                if line[pos + 1 : pos + 2] == quotechar:
+                    # escaped quote char
+                    pos += 2
+                    continue
+                in_quotes = False
+            elif line[pos : pos + 1] == quotechar:
+                in_quotes = True
+                pos += 1
+                continue
+            # skip to the next field
+            pos = line.find(delimiter, pos)
+            if pos == -1:
+                return False
+            pos += 1
+
+    def _iter_records_ends(self, mm):
+        """Yield end offset and line number of each record."""
+        size = len(mm)
+        pos = line_nr = 0
+        start = None
+        in_quotes = False
+        while pos < size:
+            eol = mm.find(b"\n", pos)
+            end = size if eol == -1 else eol + 1
+            line_nr += 1
+            line = mm[pos:end]
+            if start is None:
+                if line.strip(b"\r\n") == b"":
+                    # blank lines are ignored by csv readers
+                    pos = end
+                    continue
+                start = pos
+            pos = end
+            in_quotes = self._scan_quotes(line, in_quotes)
+            if not in_quotes:
+                # not inside a quoted value: the record is complete
+                yield end, line_nr
+                start = None
+
+    def index(self):
+        """Index records boundaries."""
+        if self.ends is not None:
+            return
+        self.ends = array("q")
+        self.line_nrs = array("l")
+        if not os.path.getsize(self.filepath):
+            # empty files cannot be mapped
+            return
+        with self._mmap() as mm:
+            for end, line_nr in self._iter_records_ends(mm):
+                self.ends.append(end)
+                self.line_nrs.append(line_nr)
+
+    def _get_fieldnames(self, mm, encoding):
+        if self.fieldnames:
+            return self.fieldnames
+        header_end, __ = next(self._iter_records_ends(mm), (0, 0))
+        with memoryview(mm) as view:
+            header = str(view[:header_end], encoding)
+        return next(csv.reader([header], **self._dialect_args()), [])
+
+    def _dialect_args(self):
+        return {"delimiter": str(self.delimiter), "quotechar": str(self.quotechar)}
+
+    def chunk_ranges(self, chunk_size):
+        """Yield byte ranges of chunks of `chunk_size` records.
+
+        Each range is a dictionary containing:
+
+        * `offset_from`: start offset in the file
+        * `offset_to`: end offset in the file
+        * `line_from`: line number matching `offset_from`
+        * `line_to`: line number of the last line of the chunk
+        """
+        self.index()
+        data_offset = 0 if self.fieldnames else 1
+        count = len(self.ends) - data_offset
+        if count <= 0:
+            return
+        chunk_size = chunk_size or count
+        for first in range(data_offset, len(self.ends), chunk_size):
+            last = min(first + chunk_size, len(self.ends)) - 1
+            yield {
+                "offset_from": self.ends[first - 1] if first else 0,
+                "offset_to": self.ends[last],
+                "line_from": self.line_nrs[first - 1] + 1 if first else 1,
+                "line_to": self.line_nrs[last],
+            }
+
+    def read_range(self, offset_from, offset_to, line_from=1):
+        """Yield lines contained in the given byte range."""
+        with self._mmap() as mm:
+            if self._read_encoding is None:
+                self._read_encoding = self._get_encoding(mm)
+                self._read_fieldnames = self._get_fieldnames(mm, self._read_encoding)
+            with memoryview(mm) as view:
+                data = str(view[offset_from:offset_to], self._read_encoding)
+        reader = csv.DictReader(
+            io.StringIO(data, newline=""),
+            fieldnames=self._read_fieldnames,
+            **self._dialect_args()
+        )
+        for line in reader:
+            line["_line_nr"] = line_from - 1 + reader.line_num
+            yield line
+
+    def range_checksum(self, offset_from, offset_to):
+        """Compute SHA-256 checksum of given byte range."""
+        with self._mmap() as mm:
+            with memoryview(mm) as view:
+                return hashlib.sha256(view[offset_from:offset_to]).hexdigest()
+
+    def read_lines(self):
+        """Yields lines and add info to them (like line nr)."""
+        # decode the file by ranges to keep memory usage bounded
+        for chunk_range in self.chunk_ranges(1000):
+            yield from self.read_range(
+                chunk_range["offset_from"],
+                chunk_range["offset_to"],
+                line_from=chunk_range["line_from"],
+            )
+
+
 def gen_chunks(iterable, chunksize=10):
     """Chunk generator.
 
@@ -128,3 +496,87 @@ def gen_chunks(iterable, chunksize=10):
             del chunk[:]
         chunk.append(line)
     yield chunk
+
+
+def compact_lines(lines):
+    """Pack lines into a compact columnar payload.
+
+    Column names are stored once in `header`
+    and each line matching it becomes a plain list of values.
+    Lines having different keys are kept as they are.
+    """
+    header = list(lines[0].keys()) if lines else []
+    rows = []
+    for line in lines:
+        if list(line.keys()) == header:
+            rows.append([line[k] for k in header])
+        else:
+            rows.append(line)
+    return {"_format": "compact", "header": header, "rows": rows}
+
+
+def is_compact_payload(payload):
+    return isinstance(payload, dict) and payload.get("_format") == "compact"
+
+
+def expand_lines(payload):
+    """Yield lines from a payload produced by `compact_lines`."""
+    header = payload["header"]
+    for row in payload["rows"]:
+        if isinstance(row, dict):
+            yield row
+        else:
+            yield dict(zip(header, row))
+
+
+def get_xmlid_map(env, xmlids):
+    """Resolve external IDs w/ a single query.
+
+    :param env: odoo environment
+    :param xmlids: iterable of fully qualified external IDs
+    :return: dictionary mapping each existing external ID
+        to a `(model, res_id)` tuple.
+    """
+    pairs = tuple({tuple(x.split(".", 1)) for x in xmlids if x and "." in x})
+    if not pairs:
+        return {}
+    env["ir.model.data"].flush(["module", "name", "model", "res_id"])
+    env.cr.execute(
+        "SELECT module, name, model, res_id FROM ir_model_data "
+        "WHERE (module, name) IN %s",
+        (pairs,),
+    )
+    return {
+        "{}.{}".format(module, name): (model, res_id)
+        for module, name, model, res_id in env.cr.fetchall()
+    }
+
+
+def is_compact_report_items(items):
+    """Tell if given report items are stored in compact form.
+
+    Compact items are stored as `{"line_nr": [...], "odoo_record": [...]}`.
+    """
+    return isinstance(items, dict)
+
+
+def count_report_items(items):
+    """Count report items, whether compact or not."""
+    if is_compact_report_items(items):
+        return len(items["line_nr"])
+    return len(items)
+
+
+def expand_report_items(items, model=""):
+    """Convert compact report items back to a list of items."""
+    if not is_compact_report_items(items):
+        return items
+    return [
+        {
+            "line_nr": line_nr,
+            "message": "",
+            "model": model,
+            "odoo_record": odoo_record or None,
+        }
+        for line_nr, odoo_record in zip(items["line_nr"], items["odoo_record"])
+    ]
@@ -2,57 +2,131 @@
 # Copyright 2018 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import zlib
+from collections import OrderedDict
 from datetime import datetime
 
 import pytz
 
 from odoo import fields
 
+from odoo.addons.queue_job.exception import RetryableJobError
+
 from ..log import logger
+from .import_utils import get_xmlid_map
 
 FMTS = ("%d/%m/%Y",)
 
 FMTS_DT = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.000")
 
 
-def to_date(value, formats=FMTS):
-    """Convert date strings to odoo format."""
+class DateConverter(object):
+    """Convert date strings to odoo format.
 
-    for fmt in formats:
-        try:
-            value = datetime.strptime(value, fmt).date()
-            break
-        except ValueError:
-            pass
-    if not isinstance(value, str):
+    Formats are tried in order, starting from the last one that matched:
+    values of a column usually share the same format.
+    """
+
+    def __init__(self, formats=FMTS, iso=False):
+        self.formats = tuple(formats)
+        # try ISO strings w/o going through `strptime`
+        self.iso = iso
+        self._last_format = None
+
+    def _formats(self):
+        if self._last_format:
+            yield self._last_format
+        for fmt in self.formats:
+            if fmt != self._last_format:
+                yield fmt
+
+    def _parse_iso(self, value):
+        # YYYY-MM-DD
+        if len(value) == 10 and value[4] == value[7] == "-":
+            try:
+                return datetime(int(value[:4]), int(value[5:7]), int(value[8:10]))
+            except ValueError:
+                pass
+        return None
+
+    def parse(self, value):
+        """Return a naive datetime or None if no format matches."""
+        if self.iso:
+            res = self._parse_iso(value)
+            if res is not None:
+                return res
+        for fmt in self._formats():
+            try:
+                res = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            self._last_format = fmt
+            return res
+        return None
+
+    def _to_string(self, value):
         try:
             return fields.Date.to_string(value)
         except ValueError:
-            pass
-    # the value has not been converted,
-    # maybe because is like 00/00/0000
-    # or in another bad format
-    return None
+            return None
+
+    def __call__(self, value):
+        if isinstance(value, str):
+            value = self.parse(value)
+            if value is None:
+                # the value has not been converted,
+                # maybe because is like 00/00/0000
+                # or in another bad format
+                return None
+            value = value.date()
+        return self._to_string(value)
+
+
+class UTCDatetimeConverter(DateConverter):
+    """Convert datetime strings to odoo format respecting TZ."""
+
+    def __init__(self, formats=FMTS_DT, tz="Europe/Rome", iso=False):
+        super().__init__(formats=formats, iso=iso)
+        self.tz = pytz.timezone(tz)
+
+    def _parse_iso(self, value):
+        # YYYY-MM-DD HH:MM:SS or YYYY-MM-DDTHH:MM:SS
+        if len(value) == 19 and value[10] in " T":
+            res = super()._parse_iso(value[:10])
+            if res is not None and value[13] == value[16] == ":":
+                try:
+                    return res.replace(
+                        hour=int(value[11:13]),
+                        minute=int(value[14:16]),
+                        second=int(value[17:19]),
+                    )
+                except ValueError:
+                    pass
+        return None
+
+    def _to_string(self, value):
+        return fields.Datetime.to_string(value)
+
+    def __call__(self, value):
+        if isinstance(value, str):
+            naive = self.parse(value)
+            if naive is None:
+                # the value has not been converted,
+                # maybe because is like 00/00/0000
+                # or in another bad format
+                return None
+            value = self.tz.localize(naive, is_dst=None).astimezone(pytz.utc)
+        return self._to_string(value)
+
+
+def to_date(value, formats=FMTS):
+    """Convert date strings to odoo format."""
+    return DateConverter(formats=formats)(value)
 
 
 def to_utc_datetime(orig_value, tz="Europe/Rome"):
     """Convert date strings to odoo format respecting TZ."""
-    value = orig_value
-    local_tz = pytz.timezone("Europe/Rome")
-    for fmt in FMTS_DT:
-        try:
-            naive = datetime.strptime(orig_value, fmt)
-            local_dt = local_tz.localize(naive, is_dst=None)
-            value = local_dt.astimezone(pytz.utc)
-            break
-        except ValueError:
-            pass
-    if not isinstance(value, str):
-        return fields.Datetime.to_string(value)
-    # the value has not been converted,
-    # maybe because is like 00/00/0000
-    # or in another bad format
-    return None
+    return UTCDatetimeConverter(tz=tz)(orig_value)
 
 
 def to_safe_float(value):
@@ -86,6 +160,12 @@ CONV_MAPPING = {
     "safe_int": to_safe_int,
 }
 
+# converters keeping a state, instantiated once per column
+CONV_CLASSES = {
+    "date": DateConverter,
+    "utc_date": UTCDatetimeConverter,
+}
+
 
 def convert(field, conv_type, fallback_field=None, pre_value_handler=None, **kw):
     """ Convert the source field to a defined ``conv_type``
@@ -94,7 +174,11 @@ def convert(field, conv_type, fallback_field=None, pre_value_handler=None, **kw)
         Use ``fallback_field`` to provide a field of the same type
         to be used in case the base field has no value.
     """
-    if conv_type in CONV_MAPPING:
+    if conv_type in CONV_CLASSES:
+        # converter options are given once here
+        conv_type = CONV_CLASSES[conv_type](**kw)
+        kw = {}
+    elif conv_type in CONV_MAPPING:
         conv_type = CONV_MAPPING[conv_type]
 
     def modifier(self, record, to_attr):
@@ -145,6 +229,8 @@ def concat(field, separator=" ", handler=None):
 
 def xmlid_to_rel(field):
     """ Convert xmlids source values to ids.
+
+    Resolved xmlids are cached in the mapper's lookup cache.
     """
 
     def modifier(self, record, to_attr):
@@ -153,20 +239,238 @@ def xmlid_to_rel(field):
             return None
         if isinstance(value, str):
             # m2o
-            rec = self.env.ref(value, raise_if_not_found=False)
-            if rec:
-                return rec.id
-            return None
+            return resolve_xmlid(self, value)
         # x2m
-        return [
-            (6, 0, self.env.ref(x).ids)
-            for x in value
-            if self.env.ref(x, raise_if_not_found=False)
-        ]
+        ids = [x for x in (resolve_xmlid(self, xmlid) for xmlid in value) if x]
+        return [(6, 0, ids)] if ids else []
+
+    def prefetch(self, records, to_attr):
+        """Resolve the xmlids of all given records w/ one query."""
+        xmlids = set()
+        for record in records:
+            value = record.get(field)
+            if isinstance(value, str):
+                xmlids.add(value)
+            elif value:
+                xmlids.update(x for x in value if isinstance(x, str))
+        prefetch_xmlids(self, xmlids)
+
+    modifier.prefetch = prefetch
 
     return modifier
 
 
+def _xmlid_cache_key(xmlid):
+    return ("ir.model.data", xmlid)
+
+
+def resolve_xmlid(mapper, xmlid):
+    """Return the id of the record matching given xmlid, if any."""
+    cache = get_lookup_cache(mapper)
+    res_id = cache.get(_xmlid_cache_key(xmlid))
+    if res_id is None:
+        rec = mapper.env.ref(xmlid, raise_if_not_found=False)
+        if not rec:
+            # not cached: it might be created later on
+            return None
+        res_id = rec.id
+        cache.set(_xmlid_cache_key(xmlid), res_id)
+    return res_id
+
+
+def prefetch_xmlids(mapper, xmlids):
+    """Resolve given xmlids w/ one query and store them into the lookup cache."""
+    found = get_xmlid_map(mapper.env, xmlids)
+    by_model = {}
+    for model, res_id in found.values():
+        by_model.setdefault(model, set()).add(res_id)
+    existing = set()
+    for model, res_ids in by_model.items():
+        if model in mapper.env:
+            records = mapper.env[model].browse(res_ids).exists()
+            existing.update((model, x) for x in records.ids)
+    cache = get_lookup_cache(mapper)
+    for xmlid, (model, res_id) in found.items():
+        if (model, res_id) in existing:
+            cache.set(_xmlid_cache_key(xmlid), res_id)
+
+
+class LookupCache(object):
+    """Bounded memoizing cache, least recently used keys are dropped first."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # keys cached since `begin_batch`
+        self._batch_keys = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        if self._batch_keys is not None:
+            self._batch_keys.add(key)
+
+    def clear(self):
+        self._data.clear()
+
+    def begin_batch(self):
+        """Keep track of keys cached from now on.
+
+        Records found or created while a savepoint is open
+        might disappear if it's rolled back: see `discard_batch`.
+        """
+        self._batch_keys = set()
+
+    def end_batch(self):
+        self._batch_keys = None
+
+    def discard_batch(self):
+        """Drop keys cached since `begin_batch`."""
+        for key in self._batch_keys or ():
+            self._data.pop(key, None)
+        self._batch_keys = None
+
+
+def get_lookup_cache(mapper):
+    """Return the lookup cache of given mapper, create it if missing.
+
+    Mappers live as long as the importer, hence the cache lasts for a chunk.
+    """
+    if getattr(mapper, "_lookup_cache", None) is None:
+        mapper._lookup_cache = LookupCache(
+            maxsize=getattr(mapper, "_lookup_cache_size", 10000)
+        )
+    return mapper._lookup_cache
+
+
+def _lookup_cache_key(model, search_field, search_operator, search_value):
+    if isinstance(search_value, list):
+        search_value = tuple(search_value)
+    key = (model, search_field, search_operator, search_value)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _lock_model_creation(cr, model):
+    """Wait for other imports creating records of the same model.
+
+    The lock is released at the end of the transaction.
+    """
+    key = zlib.crc32("connector_importer:{}".format(model).encode("utf-8"))
+    cr.execute("SELECT pg_advisory_xact_lock(%s)", (key,))
+
+
+def _search_committed_values(rel_model, search_field, values):
+    """Return the values of records committed by other transactions.
+
+    The current transaction does not see the ones committed
+    after its snapshot has been taken.
+    """
+    with rel_model.env.registry.cursor() as cr:
+        model = rel_model.with_env(rel_model.env(cr=cr))
+        rows = model.search_read([(search_field, "in", values)], [search_field])
+    res = set()
+    for row in rows:
+        key = row[search_field]
+        if isinstance(key, (list, tuple)):
+            # many2one
+            key = key[0]
+        res.add(key)
+    return res
+
+
+def _search_or_create_records(mapper, rel_model, missing, field, search_field, handler):
+    """Find records matching given values, create the ones still missing.
+
+    :param missing: list of `(search value, first record having it)` tuples
+    :return: dictionary mapping search values to lists of ids
+    """
+    res = {}
+    rows = rel_model.search_read(
+        [(search_field, "in", [x for x, __ in missing])], [search_field]
+    )
+    for row in rows:
+        key = row[search_field]
+        if isinstance(key, (list, tuple)):
+            # many2one
+            key = key[0]
+        res.setdefault(key, []).append(row["id"])
+    to_create = [(x, record) for x, record in missing if x not in res]
+    if handler:
+        for search_value, record in to_create:
+            records = handler(mapper, rel_model, record)
+            res[search_value] = records.ids if records else []
+    elif to_create:
+        vals_list = [{"name": record[field]} for __, record in to_create]
+        records = rel_model.create(vals_list)
+        for (search_value, __), rec in zip(to_create, records):
+            res[search_value] = [rec.id]
+    return res
+
+
+def _create_missing_records(
+    mapper, rel_model, missing, field, search_field, handler=None
+):
+    """Get or create missing related records in one go.
+
+    A lock held until the end of the transaction serializes imports
+    creating records of the same model: the ones waiting for it
+    find the records created meanwhile once they get it.
+    A job started before they were committed cannot see them though:
+    in that case only, it's restarted (w/o counting a retry) to find them.
+
+    :param missing: list of `(search value, first record having it)` tuples
+    :return: dictionary mapping search values to lists of ids
+    """
+    # NOTE: a lock acquired under a savepoint is released on rollback
+    _lock_model_creation(mapper.env.cr, rel_model._name)
+    if mapper.env.context.get("job_uuid"):
+        committed = _search_committed_values(
+            rel_model, search_field, [x for x, __ in missing]
+        )
+        if committed:
+            raise RetryableJobError(
+                "{} records created by another job, "
+                "restart to see them.".format(rel_model._name),
+                seconds=1,
+                ignore_retry=True,
+            )
+    try:
+        with mapper.env.cr.savepoint():
+            return _search_or_create_records(
+                mapper, rel_model, missing, field, search_field, handler
+            )
+    except Exception as e:
+        logger.error(
+            "`backend_to_rel` failed bulk creation. [model: %s] Error: %s",
+            rel_model._name,
+            str(e),
+        )
+        # let lines create them one by one
+        return {}
+
+
 # TODO: consider to move this to mapper base klass
 # to ease maintanability and override
 
@@ -210,8 +514,10 @@ def backend_to_rel(  # noqa: C901
         for getting new values for a new record to be created.
     """
 
-    def modifier(self, record, to_attr):
+    def get_search_value(self, record):
+        """Return the value to search and if it's the default one."""
         search_value = record.get(field)
+        is_default = False
 
         if search_value and value_handler:
             search_value = value_handler(self, record, search_value)
@@ -219,19 +525,24 @@ def backend_to_rel(  # noqa: C901
         # handle defaults if no search value here
         if not search_value and default_search_value:
             search_value = default_search_value
-            if default_search_field:
-                modifier.search_field = default_search_field
-
-        # get the real column and the model
-        column = self.model._fields[to_attr]
-        rel_model = self.env[column.comodel_name].with_context(active_test=False)
+            is_default = True
 
         if allowed_length and len(search_value) != allowed_length:
-            return None
+            return None, is_default
 
         # alter search value if handler is given
         if search_value and search_value_handler:
             search_value = search_value_handler(search_value)
+        return search_value, is_default
+
+    def modifier(self, record, to_attr):
+        search_value, is_default = get_search_value(self, record)
+        if is_default and default_search_field:
+            modifier.search_field = default_search_field
+
+        # get the real column and the model
+        column = self.model._fields[to_attr]
+        rel_model = self.env[column.comodel_name].with_context(active_test=False)
 
         if not search_value:
             return None
@@ -247,10 +558,20 @@ def backend_to_rel(  # noqa: C901
             # override by param
             search_operator = modifier.search_operator
 
-        # finally search it
-        search_args = [(modifier.search_field, search_operator, search_value)]
-
-        value = rel_model.search(search_args)
+        # finally search it, unless it's been done already
+        cache = get_lookup_cache(self)
+        cache_key = _lookup_cache_key(
+            rel_model._name, modifier.search_field, search_operator, search_value
+        )
+        cached_ids = cache.get(cache_key) if cache_key else None
+        if cached_ids is not None:
+            value = rel_model.browse(cached_ids)
+        else:
+            search_args = [(modifier.search_field, search_operator, search_value)]
+            value = rel_model.search(search_args)
+            # missing records might be created later on
+            if cache_key and (value or not create_missing):
+                cache.set(cache_key, tuple(value.ids))
 
         if (
             column.type.endswith("2many")
@@ -303,4 +624,69 @@ def backend_to_rel(  # noqa: C901
     modifier.search_field = search_field or "name"
     modifier.search_operator = search_operator or None
 
+    def prefetch(self, records, to_attr):
+        """Look up the values of all given records w/ one query.
+
+        Only many2one fields searched w/ the `=` operator are supported.
+        Results are stored into the lookup cache used by the modifier.
+
+        With `create_missing`, records not found are created all together.
+        """
+        column = self.model._fields[to_attr]
+        if column.type != "many2one" or modifier.search_operator not in (None, "="):
+            return
+        # first record by search value
+        search_values = OrderedDict()
+        for record in records:
+            try:
+                search_value, is_default = get_search_value(self, record)
+            except Exception:
+                # let the modifier deal with it
+                continue
+            if not search_value:
+                continue
+            if is_default and (default_search_field or create_missing):
+                # let the modifier deal with defaults
+                continue
+            try:
+                search_values.setdefault(search_value, record)
+            except TypeError:
+                continue
+        if not search_values:
+            return
+        rel_model = self.env[column.comodel_name].with_context(active_test=False)
+        search_field = modifier.search_field
+        found = OrderedDict()
+        rows = rel_model.search_read(
+            [(search_field, "in", list(search_values))], [search_field]
+        )
+        for row in rows:
+            key = row[search_field]
+            if isinstance(key, (list, tuple)):
+                # many2one
+                key = key[0]
+            found.setdefault(key, []).append(row["id"])
+        missing = [x for x in search_values if x not in found]
+        if missing and create_missing:
+            found.update(
+                _create_missing_records(
+                    self,
+                    rel_model,
+                    [(x, search_values[x]) for x in missing],
+                    field,
+                    search_field,
+                    create_missing_handler,
+                )
+            )
+        cache = get_lookup_cache(self)
+        for search_value in search_values:
+            if search_value not in found and create_missing:
+                continue
+            cache_key = _lookup_cache_key(
+                rel_model._name, search_field, "=", search_value
+            )
+            cache.set(cache_key, tuple(found.get(search_value, ())))
+
+    modifier.prefetch = prefetch
+
     return modifier